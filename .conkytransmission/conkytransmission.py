@@ -17,47 +17,181 @@
 
 #tested on ubuntu 10.04 x86_64 with python v2.6.5 and conky v1.8.0 (conky-all package)
 
+from __future__ import print_function
+
 __author__="Eric Lien"
 __date__ ="$Aug 20, 2010 6:30:03 PM$"
 __version__="0.2 beta"
 
+# only what every run needs is imported here, the rest where it's used,
+# so a run that just prints the saved output starts quickly
 import os
 import sys
-import codecs
-from optparse import OptionParser
-from subprocess import Popen, PIPE
+import zlib
+import heapq
+import time
+import struct
+import marshal
+from functools import partial
+from itertools import chain
 from operator import attrgetter
-from datetime import datetime
 
 class CommandLineParser:
 
     parser = None
+    # the fast path in main() needs to know this without building a parser
+    default_cache_dir = "~/.cache/conkytransmission"
+    # the options a section of a --views file can set, besides output
+    view_options = ["showactive", "case_sensitive", "extradata", "filterlist", "filterregex", "includelist",
+                    "includeregex", "kbps", "mbps", "minratio", "namelength", "number", "reverse", "sortby", "status",
+                    "templatespath"]
 
     def __init__(self):
+        from optparse import OptionParser
         self.parser = OptionParser()
+        self.parser.add_option("--action", dest="action", default=False, type="choice", choices=ConkyTransmissionActions.actions, metavar="NAME", help=u"Instead of showing the torrents, do this to all of them: start, stop, verify, reannounce, remove, remove-data (deletes the downloaded files too) or move (to --location). The filter options, --minratio, --status, --sortby and --number pick the torrents, as they would for showing them")
+        self.parser.add_option("-b","--backend", dest="backend", default="remote", type="choice", choices=["remote","rpc"], metavar="NAME", help=u"How to get data from transmission: 'remote' runs transmission-remote, 'rpc' talks to the daemon's RPC interface directly [default: %default]")
         self.parser.add_option("-a","--showactive", dest="show_active", default=False, action="store_true", help=u"Show only active torrents")
+        self.parser.add_option("--batchsize", dest="batch_size", default=0, type="int", metavar="NUMBER", help=u"How many torrents --action does in each request to transmission [default: all of them in one]")
+        self.parser.add_option("-c","--cachedir", dest="cache_dir", default=self.default_cache_dir, metavar="PATH", help=u"Folder to keep parsed templates and other data between runs in [default: %default]")
         self.parser.add_option("--case_sensitive", dest="case_sensitive_filter", default=False, action="store_true", help=u"Make the keyword filter case sensitive")
-        self.parser.add_option("-e","--extradata", dest="extra_data", default=False, action="store_true", help=u"Get extra torrent data (runs a command for every torrent to get more data, slower)")
+        self.parser.add_option("--dryrun", dest="dry_run", default=False, action="store_true", help=u"Print what --action would do to which torrents without doing it")
+        self.parser.add_option("--yes", dest="confirmed", default=False, action="store_true", help=u"Let --action remove or remove-data go ahead with nothing (no filter, --status, --minratio or --number) picking the torrents, doing it to every one of them")
+        self.parser.add_option("-e","--extradata", dest="extra_data", default=False, action="store_true", help=u"Get extra torrent data (one more request to transmission every refresh, slower)")
         self.parser.add_option("-f","--filterlist", dest="filter_file", default=False, metavar="FILE", help=u"File containing keywords to filter out torrents with. If the keyword is found in a torrent name, that torrent will not be shown.")
+        self.parser.add_option("--filterregex", dest="filter_regex", default=[], action="append", metavar="REGEX", help=u"Don't show torrents whose name matches this regular expression (can be given more than once)")
+        self.parser.add_option("--includelist", dest="include_file", default=False, metavar="FILE", help=u"File containing keywords, like --filterlist, but only torrents with one of them in their name will be shown")
+        self.parser.add_option("--includeregex", dest="include_regex", default=[], action="append", metavar="REGEX", help=u"Only show torrents whose name matches this regular expression (can be given more than once)")
+        self.parser.add_option("--incremental", dest="incremental", default=False, action="store_true", help=u"Remember torrents between refreshes and only parse and render the ones that changed (for --daemon)")
         self.parser.add_option("-k","--kbps",dest="k_unit", default="K", type="string", metavar="STRING", help=u"How you would like KiB/s to be shown [default: %default]")
         self.parser.add_option("-l","--namelength",dest="name_length", type="int", default=35, metavar="NUMBER", help=u"[default: %default] Length of torrent name in characters")
-        self.parser.add_option("-n","--number",dest="number", default=99, type="int", metavar="NUMBER", help=u"How many torrents will be shown [default: %default]")
+        self.parser.add_option("--location", dest="location", default=False, metavar="PATH", help=u"Where --action move moves the torrents' data to")
+        self.parser.add_option("-n","--number",dest="number", default=None, type="int", metavar="NUMBER", help=u"How many torrents will be shown [default: 99, all of them with --action]")
+        self.parser.add_option("--maxage", dest="max_age", default=0, type="float", metavar="SECONDS", help=u"Print the saved output of an earlier run, without asking transmission, if it is younger than this (most useful with conkytransmission_fast.py) [default: always refresh]")
         self.parser.add_option("-m","--mbps",dest="m_unit", default="M", type="string", metavar="STRING", help=u"How you would like MiB/s to be shown [default: %default]")
+        self.parser.add_option("--minratio", dest="min_ratio", default=None, type="float", metavar="RATIO", help=u"Only show torrents whose ratio is at least this")
+        self.parser.add_option("--rpcurl", dest="rpc_url", default="http://localhost:9091/transmission/rpc", metavar="URL", help=u"Address of transmission's RPC interface, used with --backend rpc [default: %default]")
+        self.parser.add_option("--endpoint", dest="endpoints", default=[], action="append", metavar="ENDPOINT", help=u"A transmission daemon to show torrents from, host:port for transmission-remote or an rpc url for --backend rpc. Give it more than once to show several daemons together")
+        self.parser.add_option("--endpointtimeout", dest="endpoint_timeout", default=5.0, type="float", metavar="SECONDS", help=u"How long to wait for each --endpoint before showing its last known torrents as stale [default: %default]")
+        self.parser.add_option("--rpcauth", dest="rpc_auth", default=False, metavar="USER:PASSWORD", help=u"Username and password for the RPC interface, if it needs them")
+        self.parser.add_option("--ratelimit", dest="rate_limit", default=1.0, type="float", metavar="REQUESTS", help=u"How many requests a second --action sends transmission at most, 0 for no limit [default: %default]")
         self.parser.add_option("-r","--reverse", dest="reverse_sort", default=False, action="store_true", help=u"Sort in reverse order")
-        self.parser.add_option("-s","--sortby", dest="sort_by", default="progress", type="string", metavar="option", help=u"How torrents are sorted. [default: %default] options=(percent,eta,down,up,ratio,status,progress,name)")
+        self.parser.add_option("-s","--sortby", dest="sort_by", default="progress", type="string", metavar="option", help=u"How torrents are sorted, several comma separated keys sort on each in turn, a - in front of a key reverses it (e.g. status,eta,-ratio). [default: %default] options=(percent,eta,down,up,ratio,status,progress,name)")
+        self.parser.add_option("--status", dest="statuses", default=[], action="append", metavar="STATUS", help=u"Only show torrents with this status, e.g. Seeding or Finished (can be given more than once)")
+        self.parser.add_option("--timings", dest="timings_file", default=False, metavar="FILE", help=u"Add a line of JSON with how long each stage of the refresh took to FILE after every refresh. Templates can show the times with [:T_FETCH:], [:T_PARSE:] ... [:T_TOTAL:] either way")
+        self.parser.add_option("--profile", dest="profile_file", default=False, metavar="FILE", help=u"Run the first refresh under cProfile and write the report to FILE (raw stats for pstats or snakeviz if FILE ends in .prof)")
         self.parser.add_option("-t","--templatespath", dest="template_folder", default=False, metavar="PATH", help=u"Folder where your custom templates are")
         self.parser.add_option("-v", "-V", "--version", dest="version", default=False, action="store_true", help=u"Displays the version of the script.")  
+        self.parser.add_option("-d","--daemon", dest="daemon", default=False, action="store_true", help=u"Keep running, refreshing torrent data every --interval seconds and serving the last output through --socket and/or --outfile")
+        self.parser.add_option("--history", dest="history", default=False, action="store_true", help=u"Keep the last few speeds of each torrent (in memory with --daemon, otherwise in --cachedir) for smoothed speeds, averages, sparklines and steadier statuses")
+        self.parser.add_option("--smoothing", dest="smoothing", default=10.0, type="float", metavar="SECONDS", help=u"How quickly smoothed speeds follow changes, with --history [default: %default]")
+        self.parser.add_option("-i","--interval", dest="interval", default=3.0, type="float", metavar="SECONDS", help=u"How often the daemon refreshes its output [default: %default]")
+        self.parser.add_option("-o","--outfile", dest="outfile", default=False, metavar="FILE", help=u"File the daemon atomically replaces with the last output (read it with ${cat FILE} or ${execpi 3 cat FILE})")
+        self.parser.add_option("--socket", dest="socket", default=False, metavar="PATH", help=u"Unix socket the daemon serves the last output on (read it with conkytransmission_client.py)")
+        self.parser.add_option("--views", dest="views_file", default=False, metavar="FILE", help=u"Fetch the torrents once and render each view (a section) of this INI file, with its own filters, sorting, number and templates, to its own output file (see Readme.txt)")
+        self.parser.add_option("--timeout-ms", dest="timeout_ms", default=0, type="int", metavar="MILLISECONDS", help=u"If transmission takes longer than this to answer, print the last output instead and finish the refresh in the background, for next time. [:STALE_SECS:] in a template shows how old the output is [default: no limit]")
         
-    def parse_args(self):
-        (options, args) = self.parser.parse_args()
+    # argv defaults to sys.argv
+    # with --views, options.views is (name, output file, options) for each
+    # view, the command line's options with the view's settings added
+    def parse_args(self, argv=None):
+        if argv is None:
+            argv = sys.argv
+        (options, args) = self.parser.parse_args(argv[1:])
+        self.checkOptions(options, argv)
+        options.views = list()
+        if options.views_file:
+            if options.timeout_ms > 0 or options.max_age > 0:
+                self.parser.error("--views can't be used with --timeout-ms or --maxage")
+            for (name, output, view_args) in self.getViews(options.views_file):
+                #a parser of its own, optparse would add to the lists of the last one
+                view = CommandLineParser().parser.parse_args(argv[1:] + view_args)[0]
+                self.checkOptions(view, argv)
+                view.views = list()
+                view.views_file = view.profile_file = view.timings_file = False
+                options.views.append((name, output, view))
+        return (options, args)
+
+    # fixes up what the user entered, exiting with an error if it won't do
+    def checkOptions(self, options, argv):
         #it's possible they entered in something stupid into the sortby field...
         sort_options = ['percent','eta','down','up','ratio','status','progress','name']
+        for key in options.sort_by.split(","):
+            if key.lstrip("-") not in sort_options:
+                options.sort_by = "progress"
+                break
+        options.base_path = os.path.abspath(os.path.dirname(argv[0]))
+        options.argv = argv
+        if options.action in ("remove", "remove-data") and not (options.confirmed or options.dry_run):
+            if not (options.number is not None or options.statuses or options.min_ratio is not None or options.show_active
+                    or options.filter_file or options.filter_regex or options.include_file or options.include_regex):
+                self.parser.error("--action %s with nothing picking the torrents would remove all of them. Pick them with the filter "
+                                  "options, --status, --minratio or --number (--dryrun shows which), or give --yes" % options.action)
+        if options.number is None:
+            options.number = sys.maxsize if options.action else 99
+        #statuses are matched whatever their case, but spelled as shown
+        statuses = dict([(status.lower(), status) for status in Torrent.statuses])
+        for (i, status) in enumerate(options.statuses):
+            if status.lower() not in statuses:
+                self.parser.error("unknown status %r, it can be one of %s" % (status, ", ".join(Torrent.statuses)))
+            options.statuses[i] = statuses[status.lower()]
+        if options.action:
+            if options.daemon or options.views_file or options.timeout_ms > 0 or options.max_age > 0:
+                self.parser.error("--action can't be used with --daemon, --views, --timeout-ms or --maxage")
+            if options.action == "move" and not options.location:
+                self.parser.error("--action move needs --location")
+            if options.batch_size < 0 or options.rate_limit < 0:
+                self.parser.error("--batchsize and --ratelimit can't be negative")
+        if options.daemon and not (options.socket or options.outfile or options.views_file):
+            self.parser.error("--daemon needs --socket and/or --outfile")
+        if (options.timeout_ms > 0 or options.max_age > 0) and not options.cache_dir:
+            self.parser.error("--timeout-ms and --maxage need --cachedir to keep the last output in")
+        import re
+        for pattern in options.filter_regex + options.include_regex:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                self.parser.error("bad regular expression %r: %s" % (pattern, e))
+
+    # reads a --views file, returning (name, output file, command line
+    # arguments for its settings) for each of its sections, in order
+    def getViews(self, path):
         try:
-            i = sort_options.index(options.sort_by)
-        except Exception, e:
-            options.sort_by = "progress"
-        options.base_path = os.path.abspath(os.path.dirname(sys.argv[0]))
-        return (options, args)
+            from ConfigParser import RawConfigParser, Error
+        except ImportError:
+            from configparser import RawConfigParser, Error
+        config = RawConfigParser()
+        try:
+            if not config.read([os.path.expanduser(path)]):
+                self.parser.error("can't read --views file %s" % path)
+        except Error as e:
+            self.parser.error("bad --views file %s: %s" % (path, e))
+        views = list()
+        for name in config.sections():
+            if not config.has_option(name, "output"):
+                self.parser.error("view %s has no output file" % name)
+            args = list()
+            for (key, value) in config.items(name):
+                if key == "output":
+                    continue
+                if key not in self.view_options:
+                    self.parser.error("view %s: %s can't be set for a view" % (name, key))
+                option = "--" + key
+                if self.parser.get_option(option).takes_value():
+                    #several values for options that can be given more than once, one a line
+                    for line in value.splitlines():
+                        if line.strip():
+                            args.extend([option, line.strip()])
+                    continue
+                try:
+                    if config.getboolean(name, key):
+                        args.append(option)
+                except ValueError:
+                    self.parser.error("view %s: %s should be yes or no" % (name, key))
+            views.append((name, config.get(name, "output"), args))
+        if not views:
+            self.parser.error("no views in %s" % path)
+        return views
 
     def print_help(self):
         return self.parser.print_help()
@@ -67,106 +201,990 @@ class ConkyTransmission:
     config = None
     torrent_list = list()
     filter_list = list()
+    include_list = list()
+    exclude_filter = None
+    include_filter = None
     templater = None
+    # what each --sortby key sorts on, and whether it's a number
+    # (progress is percent then ratio, highest first)
+    sort_fields = {"percent": [("percent", True)], "eta": [("eta_seconds", True)],
+                   "down": [("down_rate", True)], "up": [("up_rate", True)],
+                   "ratio": [("ratio_value", True)], "status": [("status", False)],
+                   "name": [("name", False)], "progress": [("percent", True), ("ratio_value", True)]}
+    sort_key = None
+    sort_descending = False
+    # with --history, the SpeedHistory and the slot the totals are kept in
+    history = None
+    global_slot = None
+    timer = None
+    # False for the views of --views after the first, which has already
+    # added the torrents they share to the history
+    record_history = True
+    # has the --profile refresh been done?
+    profiled = False
     
-    def __init__(self, config):
+    # backend and history, if given, are used instead of ones of its own
+    # (--views shares them between the views)
+    def __init__(self, config, backend=None, history=None):
         self.config = config
+        self.torrent_list = list()
+        self.timer = StageTimer()
         self.getFilterList()                  
+        self.getSortKey()
         try:
             self.templater = TemplateWriter(config)
         except Exception:
-            print "Could not find templates! Quitting!"
+            print("Could not find templates! Quitting!")
         else:
-            self.run()
+            self.backend = backend or getBackend(config, timer=self.timer)
+            if history is not None:
+                self.history = history
+            elif config.history:
+                path = None
+                #a file for each command line, so different daemons' totals
+                #(and torrents with the same id and name) don't mix
+                if config.cache_dir and not config.daemon:
+                    name = "speed-history-%08x" % getCRC(getRenderKey(config.argv))
+                    path = os.path.join(os.path.expanduser(config.cache_dir), name)
+                self.history = SpeedHistory(path, config.smoothing)
     
-    #parses filter_file for keywords, putting them in a list
+    #parses filter_file and include_file for keywords, putting them in lists,
+    #and compiles them with the regex options into one matcher each
     def getFilterList(self):
-        if self.config.filter_file:            
-            filtertext = getFile(self.config.filter_file)
-            if filtertext and len(filtertext) > 0:
-                filtertext = filtertext.replace(' ','').replace('\n','')
-                if not self.config.case_sensitive_filter:
-                    filtertext = filtertext.lower()
-                self.filter_list = str(filtertext).split(",")
+        config = self.config
+        self.filter_list = getKeywordList(config.filter_file)
+        self.include_list = getKeywordList(config.include_file)
+        self.exclude_filter = KeywordFilter(self.filter_list, config.filter_regex, config.case_sensitive_filter)
+        if self.include_list or config.include_regex:
+            self.include_filter = KeywordFilter(self.include_list, config.include_regex, config.case_sensitive_filter)
     
     #checks for filter words in torrent name
     def hasFilterWord(self, torrent):
-        if self.config.case_sensitive_filter:
-            name = torrent.name                    
-        else:
-            name = torrent.name.lower()
-
-        for w in self.filter_list:
-            if name.find(w) >= 0:
-                return True
-        return False
+        return self.exclude_filter.matches(torrent.name)
     
-    # scrape data from transmission-remote, separating lines
-    # returns list of lines of transmission-remote -l
+    # fetch and parse stages, lists of the backend's torrents as it gets
+    # them. total_up and total_down are set once they've all been gone through
     def scrapeTransmission(self):
-        return getCommandOutput(["transmission-remote", "-l"])
+        backend = self.backend
+        for torrents in backend.streamTorrents():
+            yield torrents
+        (self.total_up, self.total_down) = (backend.total_up, backend.total_down)
         
-    # Gathers output for conky into variables
+    # Gathers the torrents to show into torrent_list. The stages up to top-N
+    # are generators, each list of torrents the backend gives goes through
+    # all of them as it comes, and only the best --number are ever kept
     def getTorrentData(self):
-        havetorrents = False
-        torrent_lines = self.scrapeTransmission()
-        length = len(torrent_lines)
-        count = 1
-        for t in torrent_lines:
-            #for lines that contain data about torrents
-            if count > 1 and count < length:
-                t = Torrent(t, self.config)
-                if self.config.show_active:
-                    if(t.status == "Seeding" or t.status == "Downloading" or t.status == "Up & Down" and not self.hasFilterWord(t)):
-                        if self.config.extra_data:
-                            t.setExtraData(self.getExtraData(t))
-                        self.torrent_list.append(t)
-                        havetorrents = True
-                elif(not self.hasFilterWord(t)):
-                    if self.config.extra_data:
-                        t.setExtraData(self.getExtraData(t))
-                    havetorrents = True
-                    self.torrent_list.append(t)
-            #last line has relevent global stats
-            elif count == length:
-                #store global stats
-                self.getGlobalStats(t)
-            count = count + 1
-        return havetorrents
+        timer = self.timer
+        batches = self.scrapeTransmission()
+        if self.history is not None and self.record_history:
+            batches = self.recordHistory(batches)
+        batches = self.filterTorrents(batches)
+        started = time.time()
+        busy = timer.getTotal()
+        self.torrent_list = self.sortTorrents(chain.from_iterable(batches))
+        #the earlier stages ran while sort pulled torrents through them, the
+        #endpoints' fetches at the same time as each other
+        timer.addElapsed("sort", max(0, time.time() - started - (timer.getTotal() - busy)))
+        return len(self.torrent_list) > 0
+
+    # history stage, adds each torrent's speeds to the history as it goes
+    # by and works its status out from the smoothed speeds, so they don't
+    # flicker between Idle and Seeding. Torrents that have never moved any
+    # data get no slot. The totals go in after the last torrent
+    def recordHistory(self, batches):
+        history = self.history
+        now = time.time()
+        elapsed = 0.0
+        try:
+            for torrents in batches:
+                started = time.time()
+                history.lock()
+                try:
+                    for t in torrents:
+                        t.history_slot = history.addSample(getHistoryKey(t), t.up_rate, t.down_rate, now)
+                        if t.history_slot is None:
+                            t.fixStatus(t.up_rate, t.down_rate)
+                        else:
+                            t.fixStatus(*history.getSmoothed(t.history_slot))
+                finally:
+                    history.unlock()
+                elapsed = elapsed + time.time() - started
+                yield torrents
+            started = time.time()
+            history.lock()
+            try:
+                self.global_slot = history.addSample("\0totals", getNumber(self.total_up), getNumber(self.total_down), now, True)
+            finally:
+                history.unlock()
+            elapsed = elapsed + time.time() - started
+        finally:
+            self.timer.addElapsed("history", elapsed)
+
+    # reads the history of the torrents that will be shown, for the templates
+    def getHistory(self):
+        if self.history is None:
+            return None
+        for t in self.torrent_list:
+            if t.history_slot is None:
+                t.history = None
+            else:
+                t.history = self.history.getValues(t.history_slot)
+        return self.history.getValues(self.global_slot)
+
+    # filter stage, the torrents of each list that are wanted at all
+    def filterTorrents(self, batches):
+        elapsed = 0.0
+        try:
+            for torrents in batches:
+                started = time.time()
+                shown = [t for t in torrents if self.showTorrent(t)]
+                elapsed = elapsed + time.time() - started
+                if shown:
+                    yield shown
+        finally:
+            self.timer.addElapsed("filter", elapsed)
+
+    # is this torrent wanted at all?
+    def showTorrent(self, torrent):
+        config = self.config
+        if config.show_active and torrent.status not in ("Seeding", "Downloading", "Up & Down"):
+            return False
+        if config.statuses and torrent.status not in config.statuses:
+            return False
+        if config.min_ratio is not None and torrent.ratio_value < config.min_ratio:
+            return False
+        if self.include_filter is not None and not self.include_filter.matches(torrent.name):
+            return False
+        return not self.hasFilterWord(torrent)
+
+    # enrich stage, gets extra data for the torrents that will be shown,
+    # and only those whose template uses any of it (and don't have it already
+    # from this refresh, which only happens to torrents an earlier view of
+    # --views showed. The backends clear it on the Torrents --incremental
+    # hands out again, their details may have changed with the same listing)
+    def enrichTorrents(self):
+        if not self.config.extra_data:
+            return
+        needed = list()
+        fields = set()
+        for t in self.torrent_list:
+            if t.has_extra_data:
+                continue
+            extra_fields = self.templater.getExtraFields(t.status)
+            if extra_fields:
+                needed.append(t)
+                fields.update(extra_fields)
+        if needed:
+            extra_data = self.getExtraData(needed, fields)
+            for t in needed:
+                t.setExtraData(extra_data)
         
-    def getExtraData(self, torrent):
+    # gets extra data for all of the torrents in one go
+    # returns a dict of torrent id: data for Torrent.setExtraData
+    def getExtraData(self, torrents, fields):
         if self.config.extra_data:
-            return getCommandOutput(["transmission-remote", "-t", str(torrent.id), "-i"])
+            return self.backend.getExtraData(torrents, fields)
             
-    #sort logic wrapper
-    #calls multiple sort methods      
-    def sortTorrents(self):
-        sb = self.config.sort_by
-        if sb == "eta":
-            self.simpleSort("eta_seconds")
-        elif sb == "name":
-            self.simpleSort("name")
-        elif sb == "progress":
-            self.sortByProgress()
-        else:
-            self.simpleSort(sb)
-    
-    #only sorts one field, no advanced sorting        
-    def simpleSort(self, field):
-        sortover = "torrent."+field
-        self.torrent_list = sorted(self.torrent_list, key=lambda torrent: eval(sortover), reverse=self.config.reverse_sort)
-    
-    #sorts by percent, then ratio
-    def sortByProgress(self):
-        self.torrent_list = sorted(self.torrent_list, key=attrgetter('percent', 'ratio'), reverse=True)    
-        if self.config.reverse_sort:
-            self.torrent_list.reverse()
+    #works out one key function for the whole --sortby spec, so sorting
+    #is a single pass whatever the number of keys
+    def getSortKey(self):
+        keys = list()
+        for key in self.config.sort_by.split(","):
+            descending = key.startswith("-")
+            key = key.lstrip("-")
+            if key == "progress":
+                descending = not descending
+            if self.config.reverse_sort:
+                descending = not descending
+            for (attribute, numeric) in self.sort_fields[key]:
+                keys.append((attribute, numeric, descending))
+        if len(set([descending for (attribute, numeric, descending) in keys])) == 1:
+            #all one way, the attributes themselves will do
+            self.sort_key = attrgetter(*[attribute for (attribute, numeric, descending) in keys])
+            self.sort_descending = keys[0][2]
+            return
+        getters = list()
+        for (attribute, numeric, descending) in keys:
+            getter = attrgetter(attribute)
+            if descending and numeric:
+                getter = partial(getNegated, getter)
+            elif descending:
+                getter = partial(getDescending, getter)
+            getters.append(getter)
+        self.sort_key = lambda torrent: tuple([getter(torrent) for getter in getters])
+        self.sort_descending = False
+
+    #sort and top-N stages, returns the first --number of torrents (any
+    #iterable) in --sortby order. They're picked with a heap of --number
+    #as they come, so the rest are never all kept at once
+    def sortTorrents(self, torrents):
+        number = self.config.number
+        if number < 0:
+            return sorted(torrents, key=self.sort_key, reverse=self.sort_descending)[:number]
+        if self.sort_descending:
+            return heapq.nlargest(number, torrents, key=self.sort_key)
+        return heapq.nsmallest(number, torrents, key=self.sort_key)
     
+    # Runs the process from start to finish, returning the text for conky
+    # can be called again on the same object to refresh (daemon mode)
+    def render(self):
+        if self.config.profile_file and not self.profiled:
+            self.profiled = True
+            return renderProfiled(self.render, self.config.profile_file)
+        timer = self.timer
+        timer.reset()
+        self.torrent_list = list()
+        self.templater.reset()
+        if self.getTorrentData():
+            started = time.time()
+            self.enrichTorrents()
+            timer.add("enrich", started)
+            started = time.time()
+            global_history = self.getHistory()
+            self.templater.getTorrentOutput(self.torrent_list)
+            self.templater.getGlobalsOutput(self.total_up, self.total_down, global_history)
+            output = self.templater.getOutput()
+            timer.add("render", started)
+        else:
+            output = ""
+        self.templater.cache.save()
+        return timer.setTimings(output)
+
+    # adds this refresh's stage times to --timings, if it was given
+    def logTimings(self):
+        if self.config.timings_file:
+            self.timer.log(self.config.timings_file, len(self.torrent_list))
+
+    # renders in a child process, giving it timeout seconds before falling
+    # back on the last good output. A child that misses the deadline carries
+    # on and saves its output for the next run, and no new child is started
+    # while one is still going or while failures are being backed off from
+    # returns the output, [:STALE_SECS:] filled in
+    def renderWithin(self, timeout):
+        deadline = time.time() + timeout
+        cache = RenderCache(self.config.cache_dir, getRenderKey(self.config.argv))
+        if cache.isBackingOff() or not cache.lock():
+            return cache.getOutput()
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.renderChild(cache, write_fd)
+        os.close(write_fd)
+        message = readPipe(read_fd, deadline)
+        if message is None:
+            return cache.getOutput()
+        os.waitpid(pid, 0)
+        if message[:1] != b"1":
+            return cache.getOutput()
+        return setStaleSecs(message[1:].decode("utf-8"), 0)
+
+    # the child's side of renderWithin, never returns
+    # sends "1" and the output down the pipe, or "0" if the render failed
+    def renderChild(self, cache, write_fd):
+        import signal
+        status = 1
+        try:
+            #conky waits for everything holding our stdout to close it
+            os.setsid()
+            signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            try:
+                output = self.render()
+            except Exception:
+                cache.setFailed()
+                message = b"0"
+            else:
+                cache.setOutput(output)
+                self.logTimings()
+                message = b"1" + output.encode("utf-8")
+                status = 0
+            try:
+                while message:
+                    message = message[os.write(write_fd, message):]
+            except OSError:
+                #the parent gave up waiting
+                pass
+        finally:
+            os._exit(status)
+
+    # Runs the process from start to finish, printing data for conky
+    def run(self):
+        if self.templater:
+            if self.config.timeout_ms > 0:
+                output = self.renderWithin(self.config.timeout_ms / 1000.0)
+            else:
+                try:
+                    output = self.render()
+                except (CommandError, RPCError) as e:
+                    sys.stderr.write("conkytransmission: %s\n" % e)
+                    output = ""
+                else:
+                    if self.config.max_age > 0:
+                        RenderCache(self.config.cache_dir, getRenderKey(self.config.argv)).setOutput(output)
+                output = setStaleSecs(output, 0)
+            started = time.time()
+            if output:
+                writeOutput(output)
+            self.timer.add("output", started)
+            if self.config.timeout_ms <= 0:
+                self.logTimings()
+
+class KeywordFilter:
+    """Checks torrent names for any of a list of keywords and regular
+    expressions, the keywords all at once with one compiled regular
+    expression, remembering the answer for each name across refreshes"""
+    # how many names to remember before starting over
+    max_results = 4096
+    # the search methods of the compiled keywords and of each pattern
+    searches = None
+
+    # each pattern is compiled on its own, joined up their flags,
+    # backreferences and group names would get in each other's way
+    def __init__(self, keywords, patterns, case_sensitive):
+        import re
+        flags = re.UNICODE
+        if not case_sensitive:
+            flags = flags | re.IGNORECASE
+        self.searches = list()
+        if keywords:
+            self.searches.append(re.compile(getKeywordPattern(keywords, case_sensitive), flags).search)
+        for pattern in patterns:
+            self.searches.append(re.compile(pattern, flags).search)
+        self.results = dict()
+
+    # does the name contain any of the keywords or match any of the patterns?
+    def matches(self, name):
+        try:
+            return self.results[name]
+        except KeyError:
+            if len(self.results) >= self.max_results:
+                self.results.clear()
+            result = False
+            for search in self.searches:
+                if search(name) is not None:
+                    result = True
+                    break
+            self.results[name] = result
+            return result
+
+class ConkyTransmissionViews:
+    """Renders every view of a --views file from one fetch of the torrents,
+    writing each one to its own file"""
+    config = None
+    # (name, output file, ConkyTransmission) for each view
+    views = None
+    backend = None
+    # the first view's TemplateWriter, None if any view's templates are missing
+    templater = None
+    # the shared fetch and parse, and every view's other stages added up
+    timer = None
+    # has the --profile refresh been done?
+    profiled = False
+
+    def __init__(self, config):
+        self.config = config
+        self.timer = StageTimer()
+        self.views = list()
+        self.backend = SharedBackend(getBackend(config, timer=self.timer))
+        history = None
+        for (name, output, view_config) in config.views:
+            conky = ConkyTransmission(view_config, self.backend, history)
+            if not conky.templater:
+                return
+            if history is None:
+                history = conky.history
+            else:
+                conky.record_history = False
+            if view_config.extra_data:
+                for status in Torrent.statuses:
+                    self.backend.fields.update(conky.templater.getExtraFields(status))
+            self.views.append((name, output, conky))
+        self.templater = self.views[0][2].templater
+
+    # fetches the torrents once and renders each view from them to its file
+    # returns "", there's nothing to print
+    def render(self):
+        if self.config.profile_file and not self.profiled:
+            self.profiled = True
+            return renderProfiled(self.render, self.config.profile_file)
+        timer = self.timer
+        timer.reset()
+        self.backend.refresh()
+        first = self.views[0][2]
+        for (name, path, conky) in self.views:
+            if not conky.record_history:
+                conky.global_slot = first.global_slot
+            output = conky.render()
+            for stage in timer.stages:
+                if conky.timer.calls[stage]:
+                    timer.addElapsed(stage, conky.timer.times[stage])
+            started = time.time()
+            #one view that can't be written shouldn't keep the rest from it
+            try:
+                writeFile(path, setStaleSecs(output, 0))
+            except (IOError, OSError) as e:
+                sys.stderr.write("conkytransmission: view %s: %s\n" % (name, e))
+            timer.add("output", started)
+        return ""
+
+    # adds this refresh's stage times to --timings, if it was given
+    def logTimings(self):
+        if self.config.timings_file:
+            self.timer.log(self.config.timings_file, sum([len(view[2].torrent_list) for view in self.views]))
+
+    def run(self):
+        if self.templater:
+            try:
+                self.render()
+            except (CommandError, RPCError) as e:
+                sys.stderr.write("conkytransmission: %s\n" % e)
+                return
+            self.logTimings()
+
+class ConkyTransmissionActions(ConkyTransmission):
+    """Does one --action to every torrent ConkyTransmission would show, a
+    batch of torrents to each request, sent no faster than --ratelimit"""
+    # what --action can do, the backends know how to ask transmission for each
+    actions = ["start", "stop", "verify", "reannounce", "remove", "remove-data", "move"]
+    # when the last request was sent, for --ratelimit
+    sent_time = None
+
+    # the same filters, sorting and backend as showing the torrents, but
+    # no templates or history
+    def __init__(self, config):
+        self.config = config
+        self.torrent_list = list()
+        self.timer = StageTimer()
+        self.getFilterList()
+        self.getSortKey()
+        self.backend = getBackend(config, timer=self.timer)
+
+    # the torrents for --action, in --sortby order, with one line for
+    # each printed. Torrents of --endpoint daemons that didn't answer are
+    # left alone, what is known of them may be out of date
+    def getActionTorrents(self):
+        self.getTorrentData()
+        torrents = [t for t in self.torrent_list if not t.stale]
+        if len(torrents) < len(self.torrent_list):
+            sys.stderr.write("conkytransmission: skipping %d torrents of daemons that didn't answer\n" %
+                             (len(self.torrent_list) - len(torrents)))
+        prefix = self.config.dry_run and "would " or ""
+        lines = list()
+        for t in torrents:
+            endpoint = t.endpoint and t.endpoint + " " or ""
+            lines.append(u"%s%s %s%s %s (%s, ratio %s)" % (prefix, self.config.action, endpoint, t.id, t.name, t.status, t.ratio))
+        if lines:
+            writeOutput(u"\n".join(lines))
+        return torrents
+
+    # splits torrents into the batches sent in one request each: at most
+    # --batchsize, and every one from a single daemon
+    def getBatches(self, torrents):
+        size = self.config.batch_size or len(torrents)
+        batches = list()
+        endpoints = dict()
+        for t in torrents:
+            if t.endpoint not in endpoints:
+                endpoints[t.endpoint] = list()
+                batches.append(endpoints[t.endpoint])
+            endpoints[t.endpoint].append(t)
+        return [batch[i:i + size] for batch in batches for i in range(0, len(batch), size)]
+
+    # waits until the next request is allowed by --ratelimit
+    def waitForTurn(self):
+        if self.sent_time is not None and self.config.rate_limit > 0:
+            time.sleep(max(0, self.sent_time + 1.0 / self.config.rate_limit - time.time()))
+        self.sent_time = time.time()
+
+    # does --action to the torrents, or with --dryrun just says what it
+    # would do. Stops at the first request that fails
+    # returns the exit status
+    def run(self):
+        config = self.config
+        try:
+            torrents = self.getActionTorrents()
+        except (CommandError, RPCError) as e:
+            sys.stderr.write("conkytransmission: %s\n" % e)
+            return 1
+        if config.dry_run:
+            writeOutput(u"%s: %d torrents, nothing done (--dryrun)" % (config.action, len(torrents)))
+            return 0
+        done = 0
+        requests = 0
+        for batch in self.getBatches(torrents):
+            self.waitForTurn()
+            try:
+                self.backend.doAction(config.action, batch, config.location or None)
+            except Exception as e:
+                sys.stderr.write("conkytransmission: %s failed after %d of %d torrents: %s\n" %
+                                 (config.action, done, len(torrents), e))
+                return 1
+            done = done + len(batch)
+            requests = requests + 1
+        writeOutput(u"%s: %d torrents in %d requests" % (config.action, done, requests))
+        return 0
+
+class ConkyTransmissionDaemon:
+    """Refreshes ConkyTransmission output on a schedule and keeps the last result for clients"""
+    config = None
+    conky = None
+    output = ""
+    # when output was rendered
+    output_time = None
+    server = None
+    # refreshes that have failed in a row, and when to try again
+    failures = 0
+    retry_at = 0
+    # why --outfile couldn't be written last time, so it is only told once
+    outfile_error = None
+
+    def __init__(self, config):
+        self.config = config
+        if config.views:
+            self.conky = ConkyTransmissionViews(config)
+        else:
+            self.conky = ConkyTransmission(config)
+
+    # Loops forever, refreshing output every config.interval seconds
+    def run(self):
+        if not self.conky.templater:
+            return
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            if self.config.socket:
+                self.startServer()
+            while True:
+                started = time.time()
+                refreshed = started >= self.retry_at and self.refresh()
+                output_started = time.time()
+                if self.config.outfile:
+                    self.writeOutfile()
+                if refreshed:
+                    self.conky.timer.add("output", output_started)
+                    self.conky.logTimings()
+                time.sleep(max(0, self.config.interval - (time.time() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopServer()
+
+    # renders once, keeping the last good output if something goes wrong
+    # and waiting longer before each retry while it keeps going wrong
+    # returns whether it worked
+    def refresh(self):
+        try:
+            output = self.conky.render()
+        except Exception as e:
+            self.failures = self.failures + 1
+            delay = getBackoff(self.failures, self.config.interval, RenderCache.backoff_max)
+            self.retry_at = time.time() + delay
+            sys.stderr.write("conkytransmission: refresh failed: %s, retrying in %.1fs\n" % (e, delay))
+            return False
+        self.output = output
+        self.output_time = time.time()
+        self.failures = 0
+        self.retry_at = 0
+        return True
+
+    # the last good output, [:STALE_SECS:] filled in
+    def getOutput(self):
+        if self.output_time is None:
+            return self.output
+        return setStaleSecs(self.output, time.time() - self.output_time)
+
+    # writes the last output to --outfile, carrying on (and saying so on
+    # stderr) if it can't
+    def writeOutfile(self):
+        try:
+            writeFile(self.config.outfile, self.getOutput())
+        except (IOError, OSError) as e:
+            if str(e) != self.outfile_error:
+                self.outfile_error = str(e)
+                sys.stderr.write("conkytransmission: can't write %s: %s\n" % (self.config.outfile, e))
+        else:
+            self.outfile_error = None
+
+    def startServer(self):
+        import socket
+        import threading
+        path = os.path.expanduser(self.config.socket)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(5)
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def stopServer(self):
+        server = self.server
+        if server:
+            self.server = None
+            server.close()
+            try:
+                os.unlink(os.path.expanduser(self.config.socket))
+            except OSError:
+                pass
+
+    # answers every connection with the last output, then hangs up,
+    # until stopServer closes the socket
+    def serve(self):
+        import socket
+        while True:
+            server = self.server
+            if server is None:
+                break
+            try:
+                client = server.accept()[0]
+            except socket.error:
+                continue
+            try:
+                client.sendall(self.getOutput().encode("utf-8"))
+            except socket.error:
+                pass
+            client.close()
+            
+# picks the backend named by config.backend, for one endpoint
+# (or the default daemon), or all of config.endpoints together
+# timer is the StageTimer to add fetch and parse times to
+def getBackend(config, endpoint=None, timer=None):
+    if timer is None:
+        timer = StageTimer()
+    if endpoint is None and len(config.endpoints) > 1:
+        return MultiBackend(config, timer)
+    if endpoint is None and config.endpoints:
+        endpoint = config.endpoints[0]
+    if config.backend == "rpc":
+        return RPCBackend(config, endpoint, timer)
+    return RemoteBackend(config, endpoint, timer)
+
+class SharedBackend:
+    """Hands every view of --views the torrents of one fetch from the real backend"""
+    backend = None
+    torrents = None
+    total_up = None
+    total_down = None
+    # the extra fields of every view with --extradata, asked for together
+    # because the views share the Torrents they fill in
+    fields = None
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.torrents = list()
+        self.fields = set()
+
+    # fetches (and parses) the torrents for all of the views
+    def refresh(self):
+        (self.torrents, self.total_up, self.total_down) = self.backend.getTorrents()
+
+    def getTorrents(self):
+        return (self.torrents, self.total_up, self.total_down)
+
+    def streamTorrents(self):
+        return [self.torrents]
+
+    def getExtraData(self, torrents, fields):
+        return self.backend.getExtraData(torrents, self.fields.union(fields))
+
+class MultiBackend:
+    """Gets torrent data from several transmission daemons at once, one
+    thread each, showing the last known torrents of any that are too slow"""
+    config = None
+    endpoints = None
+    timer = None
+    # from the last streamTorrents()
+    total_up = None
+    total_down = None
+
+    # fetch and parse times are added up over all of the endpoints
+    def __init__(self, config, timer):
+        self.config = config
+        self.timer = timer
+        self.endpoints = [Endpoint(config, name) for name in config.endpoints]
+
+    # returns (list of Torrents, total up speed, total down speed) for all
+    # of the endpoints, waiting at most config.endpoint_timeout for them
+    def getTorrents(self):
+        deadline = time.time() + self.config.endpoint_timeout
+        for endpoint in self.endpoints:
+            endpoint.start()
+        for endpoint in self.endpoints:
+            endpoint.wait(deadline - time.time())
+        for endpoint in self.endpoints:
+            endpoint.addTimes(self.timer)
+        torrents = list()
+        total_up = total_down = None
+        for endpoint in self.endpoints:
+            (endpoint_torrents, up, down) = endpoint.getResult()
+            stale = endpoint.isStale()
+            for t in endpoint_torrents:
+                t.stale = stale
+            torrents.extend(endpoint_torrents)
+            if up is not None:
+                total_up = (total_up or 0) + getNumber(up)
+            if down is not None:
+                total_down = (total_down or 0) + getNumber(down)
+        if total_up is not None:
+            total_up = "%.1f" % total_up
+        if total_down is not None:
+            total_down = "%.1f" % total_down
+        return (torrents, total_up, total_down)
+
+    # the torrents of getTorrents as one list, for ConkyTransmission's
+    # pipeline, leaving the totals in total_up and total_down
+    def streamTorrents(self):
+        (torrents, self.total_up, self.total_down) = self.getTorrents()
+        return [torrents]
+
+    # gets extra data from each endpoint for its own torrents, skipping
+    # endpoints that are still busy
+    # returns a dict of (endpoint, torrent id): data for Torrent.setExtraData
+    def getExtraData(self, torrents, fields):
+        extra_data = dict()
+        for endpoint in self.endpoints:
+            mine = [t for t in torrents if t.endpoint == endpoint.name]
+            if not mine or endpoint.isStale():
+                continue
+            #its thread is done, so the endpoint's timer can be used here
+            endpoint.timer.reset()
+            try:
+                data = endpoint.backend.getExtraData(mine, fields)
+            except Exception as e:
+                sys.stderr.write("conkytransmission: %s: %s\n" % (endpoint.name, e))
+                continue
+            finally:
+                self.timer.addTimer(endpoint.timer)
+            for (torrent_id, torrent_data) in data.items():
+                extra_data[(endpoint.name, torrent_id)] = torrent_data
+        return extra_data
+
+    # does an --action to torrents, which are all from one endpoint
+    def doAction(self, action, torrents, location=None):
+        for endpoint in self.endpoints:
+            if endpoint.name == torrents[0].endpoint:
+                endpoint.backend.doAction(action, torrents, location)
+
+class Endpoint:
+    """One of the daemons a MultiBackend shows, with the last torrents it gave"""
+    name = None
+    backend = None
+    thread = None
+    # the fetch and parse times of the thread's refresh, kept apart from the
+    # other endpoints' until it has finished and they can be added up
+    timer = None
+    timed = False
+    # (list of Torrents, total up speed, total down speed) from the last
+    # refresh that worked, None until one has
+    result = None
+    # what went wrong with the last refresh, if it didn't work
+    error = None
+    # where result is saved for the next run, outside --daemon
+    path = None
+
+    def __init__(self, config, name):
+        self.name = name
+        self.timer = StageTimer()
+        self.backend = getBackend(config, name, self.timer)
+        if config.cache_dir and not config.daemon:
+            self.path = os.path.join(os.path.expanduser(config.cache_dir), "endpoint-%08x" % getCRC(name))
+
+    # starts getting torrents in the background, unless the last
+    # refresh still hasn't finished
+    def start(self):
+        import threading
+        if self.thread is None or not self.thread.is_alive():
+            self.timer.reset()
+            self.timed = False
+            self.thread = threading.Thread(target=self.refresh)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def wait(self, timeout):
+        self.thread.join(max(0, timeout))
+
+    # adds the times of the last refresh to timer, if it has finished. One
+    # still going when the refresh it was started for gives up on it isn't
+    # counted at all
+    def addTimes(self, timer):
+        if not self.timed and not self.thread.is_alive():
+            timer.addTimer(self.timer)
+        self.timed = True
+
+    def refresh(self):
+        try:
+            (torrents, up, down) = self.backend.getTorrents()
+        except Exception as e:
+            self.error = e
+            sys.stderr.write("conkytransmission: %s: %s\n" % (self.name, e))
+            return
+        for t in torrents:
+            t.endpoint = self.name
+        self.result = (torrents, up, down)
+        self.error = None
+        self.save()
+
+    # result, or while no refresh has worked yet, the one an earlier run saved
+    def getResult(self):
+        if self.result is None:
+            self.result = self.load()
+        return self.result
+
+    # writes result for the next run, the way RenderCache does
+    def save(self):
+        if self.path is None:
+            return
+        (torrents, up, down) = self.result
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+            fileoutput = open(tmp_path, "wb")
+            marshal.dump((self.name, [t.getSaved() for t in torrents], up, down), fileoutput)
+            fileoutput.close()
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError, ValueError):
+            pass
+
+    # the result an earlier run saved, no torrents if there isn't one
+    def load(self):
+        try:
+            fileinput = open(self.path, "rb")
+            try:
+                (name, saved, up, down) = marshal.load(fileinput)
+            finally:
+                fileinput.close()
+        except Exception:
+            return (list(), None, None)
+        #two endpoints could share a crc
+        if name != self.name:
+            return (list(), None, None)
+        torrents = [loadTorrent(values) for values in saved]
+        for t in torrents:
+            t.endpoint = self.name
+        return (torrents, up, down)
+
+    # is result older than this refresh?
+    def isStale(self):
+        return self.thread.is_alive() or self.error is not None
+
+class RemoteBackend:
+    """Gets torrent data by running transmission-remote and reading its output"""
+    config = None
+    # with --incremental, the Torrent made from each line of the last refresh
+    snapshot = None
+    # match() of the regular expression for a torrent line of -l
+    match_line = None
+    # transmission-remote and the daemon it talks to, if not the default one
+    command = None
+    # from the Sum: line of the last listing
+    total_up = None
+    total_down = None
+    # transmission-remote's option for each --action
+    action_options = {"start": "--start", "stop": "--stop", "verify": "--verify", "reannounce": "--reannounce",
+                      "remove": "--remove", "remove-data": "--remove-and-delete", "move": "--move"}
+
+    def __init__(self, config, endpoint=None, timer=None):
+        self.config = config
+        self.timer = timer or StageTimer()
+        self.snapshot = dict()
+        self.match_line = getListPattern().match
+        self.command = ["transmission-remote"]
+        if endpoint:
+            self.command.append(endpoint)
+
+    # returns (list of Torrents, total up speed, total down speed)
+    # from the lines of transmission-remote -l
+    def getTorrents(self):
+        torrents = list(chain.from_iterable(self.streamTorrents()))
+        return (torrents, self.total_up, self.total_down)
+
+    # the Torrents of transmission-remote -l, a list at a time as their
+    # lines are printed, leaving the totals in total_up and total_down
+    # (the time spent waiting for it is the fetch stage)
+    def streamTorrents(self):
+        return self.parseTorrents(readCommand(self.command + ["-l"], self.timer))
+
+    # parse stage, yields a list of Torrents for each list of lines of a
+    # listing. Lines are told apart by what is in them, not where they are:
+    # torrent lines start with their id and the Sum: line has the totals,
+    # anything else (the header) is skipped. A torrent line is split into
+    # its columns with one regular expression, or on double spaces if it
+    # doesn't look the way it should
+    # with --incremental, lines that haven't changed since the last
+    # refresh give back the same Torrent without parsing it again
+    def parseTorrents(self, batches):
+        incremental = self.config.incremental
+        match_line = self.match_line
+        previous = self.snapshot
+        snapshot = dict()
+        self.total_up = self.total_down = None
+        elapsed = 0.0
+        try:
+            for lines in batches:
+                started = time.time()
+                torrents = list()
+                for line in lines:
+                    torrent = previous and previous.get(line)
+                    if torrent:
+                        torrent.has_extra_data = False
+                    else:
+                        values = match_line(line)
+                        if values is not None:
+                            torrent = Torrent(values.groups())
+                        elif line.startswith("Sum:"):
+                            (self.total_up, self.total_down) = self.getGlobalStats(line)
+                            continue
+                        elif line.lstrip()[:1].isdigit():
+                            torrent = Torrent(splitLine(line))
+                        else:
+                            continue
+                    if incremental:
+                        snapshot[line] = torrent
+                    torrents.append(torrent)
+                elapsed = elapsed + time.time() - started
+                if torrents:
+                    yield torrents
+        finally:
+            self.timer.addElapsed("parse", elapsed)
+        if incremental:
+            self.snapshot = snapshot
+
+    # runs transmission-remote -i once for all of the torrents
+    # (it always prints every field, so fields is not used)
+    # returns a dict of torrent id: list of that torrent's lines
+    def getExtraData(self, torrents, fields):
+        extra_data = dict()
+        if not torrents:
+            return extra_data
+        ids = ",".join([str(t.id) for t in torrents])
+        lines = list()
+        for l in chain.from_iterable(readCommand(self.command + ["-t", ids, "-i"])):
+            #every torrent's section has an Id: line near its top
+            if l.strip().startswith("Id:"):
+                lines = list()
+                extra_data[int(l.strip()[3:])] = lines
+            lines.append(l)
+        return extra_data
+
+    # does an --action to all of the torrents with one transmission-remote,
+    # which says "success" when transmission did it
+    def doAction(self, action, torrents, location=None):
+        command = self.command + ["-t", ",".join([str(t.id) for t in torrents]), self.action_options[action]]
+        if location is not None:
+            command.append(location)
+        lines = list(chain.from_iterable(readCommand(command)))
+        if not [l for l in lines if l.rstrip().endswith('"success"')]:
+            raise CommandError("%s failed: %s" % (command[0], " ".join([l.strip() for l in lines]) or "no answer"))
+
     # Parses out global stats from last line of
-    # transmission-remote -l output and forms 
-    # conky script for it
+    # transmission-remote -l output
     def getGlobalStats(self, info_line):
-        out = ''
+        total_up = total_down = None
         #properties are separated by at least 2 spaces
         info_list = info_line.split("  ")
         count = 0
@@ -177,204 +1195,455 @@ class ConkyTransmission:
                 count = count + 1
                 # we only care about properties 3 and 4 (up and down speed)
                 if count == 3:
-                    self.total_up = p                      
+                    total_up = p                      
                 elif count == 4:
-                    self.total_down = p
-        
-    
-    # Runs the process from start to finish, printing data for conky
-    def run(self):
-        if self.getTorrentData():
-            self.sortTorrents()
-            #get rid of any torrents more than the configured max
-            self.torrent_list = self.torrent_list[:self.config.number]
-            self.templater.getTorrentOutput(self.torrent_list)
-            self.templater.getGlobalsOutput(self.total_up, self.total_down)
-            print self.templater.getOutput()
-            
-class Torrent:
-    """Parses out torrent properties from a lines of output of transmission-remote"""
-    id = None
-    percent = None
-    eta = None
-    eta_seconds = None
-    up = None
-    down = None
-    ratio = None
-    status = None
-    name = None
-    location = None
-    available = None
-    size = None
-    downloaded = None
-    uploaded = None
-    ratio_limit = None
-    corrupt = None
-    connected_to = None
-    uploading_to = None
-    downloading_from = None
-    datetime_added = None
-    datetime_started = None
-    datetime_latest_activity = None
-    public_torrent = None
-    pieces = None
-    piece_size = None
-    
+                    total_down = p
+        return (total_up, total_down)
+
+class CommandError(Exception):
+    """transmission-remote failed or couldn't be run, usually because the daemon isn't running"""
+
+class RPCError(Exception):
+    """Transmission's RPC interface refused or failed a request"""
 
-    # parses an input line of torrent properties into
-    # class variables
-    def __init__(self, properties, config):
+class RPCBackend:
+    """Gets torrent data straight from transmission's JSON-RPC interface"""
+    # fields every torrent needs for filtering, sorting and picking a template
+    list_fields = ["id", "name", "percentDone", "eta", "leftUntilDone", "rateUpload", "rateDownload",
+                   "uploadRatio", "status", "isFinished", "peersGettingFromUs", "peersSendingToUs"]
+    # rpc fields needed for each of Torrent.extra_fields
+    extra_fields = {
+        "location": ["downloadDir"],
+        "available": ["sizeWhenDone", "leftUntilDone", "desiredAvailable"],
+        "size": ["sizeWhenDone"],
+        "downloaded": ["downloadedEver"],
+        "uploaded": ["uploadedEver"],
+        "ratio_limit": ["seedRatioMode", "seedRatioLimit"],
+        "corrupt": ["corruptEver"],
+        "connected_to": ["peersConnected"],
+        "uploading_to": ["peersGettingFromUs"],
+        "downloading_from": ["peersSendingToUs"],
+        "datetime_added": ["addedDate"],
+        "datetime_started": ["startDate"],
+        "datetime_latest_activity": ["activityDate"],
+        "public_torrent": ["isPrivate"],
+        "pieces": ["pieceCount"],
+        "piece_size": ["pieceSize"],
+    }
+    # the rpc method for each --action, and its arguments besides the ids
+    action_methods = {"start": ("torrent-start", {}), "stop": ("torrent-stop", {}),
+                      "verify": ("torrent-verify", {}), "reannounce": ("torrent-reannounce", {}),
+                      "remove": ("torrent-remove", {}), "remove-data": ("torrent-remove", {"delete-local-data": True}),
+                      "move": ("torrent-set-location", {"move": True})}
+    config = None
+    connection = None
+    session_id = None
+    # with --incremental, torrent id: (rpc fields, Torrent) from the last refresh
+    snapshot = None
+    # from the last streamTorrents()
+    total_up = None
+    total_down = None
+
+    def __init__(self, config, endpoint=None, timer=None):
+        try:
+            from urlparse import urlparse
+        except ImportError:
+            from urllib.parse import urlparse
         self.config = config
-        properties = properties.split("  ")
-        count = 0
-        for p in properties:
-            p = p.lstrip().rstrip()
-            if p != '':
-                #convert non-blanks into proper format
-                count = count + 1
-                if count == 1:
-                    self.setId(p)
-                elif count == 2:
-                    self.setPercent(p)
-                elif count == 4:
-                    self.setETA(p)
-                elif count == 5:
-                    self.up = p
-                elif count == 6:
-                    self.down = p
-                elif count == 7:
-                    self.ratio = p
-                elif count == 8:
-                    self.status = p
-                elif count == 9:
-                    self.name = p
+        self.timer = timer or StageTimer()
+        url = endpoint or config.rpc_url
+        if "://" not in url:
+            url = "http://" + url
+        url = urlparse(url)
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 9091
+        self.path = url.path or "/transmission/rpc"
+        self.auth = None
+        if config.rpc_auth:
+            import base64
+            self.auth = "Basic " + base64.b64encode(config.rpc_auth.encode("utf-8")).decode("ascii")
+        self.snapshot = dict()
+
+    # returns (list of Torrents, total up speed, total down speed)
+    # with --incremental, only torrents transmission calls recently active are
+    # asked for after the first refresh, and only the ones whose fields
+    # changed are made into new Torrents
+    def getTorrents(self):
+        started = time.time()
+        if self.config.incremental and self.snapshot:
+            snapshot = self.snapshot
+            reply = self.request("torrent-get", {"ids": "recently-active", "fields": self.list_fields})
+            for torrent_id in reply.get("removed", []):
+                snapshot.pop(torrent_id, None)
+        else:
+            snapshot = dict()
+            reply = self.request("torrent-get", {"fields": self.list_fields})
+        self.timer.add("fetch", started)
+        started = time.time()
+        for data in reply["torrents"]:
+            previous = snapshot.get(data["id"])
+            if previous is None or previous[0] != data:
+                snapshot[data["id"]] = (data, Torrent(data))
+        if self.config.incremental:
+            self.snapshot = snapshot
+        torrents = list()
+        total_up = total_down = 0
+        for torrent_id in sorted(snapshot.keys()):
+            (data, t) = snapshot[torrent_id]
+            t.has_extra_data = False
+            torrents.append(t)
+            total_up = total_up + data["rateUpload"]
+            total_down = total_down + data["rateDownload"]
+        self.timer.add("parse", started)
+        return (torrents, getKBps(total_up), getKBps(total_down))
+
+    # the torrents of getTorrents as one list, for ConkyTransmission's
+    # pipeline, leaving the totals in total_up and total_down
+    def streamTorrents(self):
+        (torrents, self.total_up, self.total_down) = self.getTorrents()
+        return [torrents]
+
+    # gets the given extra fields for all of the torrents in one call,
+    # asking transmission for nothing more than those need
+    # returns a dict of torrent id: dict of rpc fields
+    def getExtraData(self, torrents, fields):
+        extra_data = dict()
+        rpc_fields = ["id"]
+        for f in fields:
+            for rpc_field in self.extra_fields.get(f, []):
+                if rpc_field not in rpc_fields:
+                    rpc_fields.append(rpc_field)
+        if len(rpc_fields) == 1 or not torrents:
+            return extra_data
+        ids = [t.id for t in torrents]
+        for data in self.request("torrent-get", {"ids": ids, "fields": rpc_fields})["torrents"]:
+            extra_data[data["id"]] = data
+        return extra_data
+
+    # does an --action to all of the torrents in one call, on the same
+    # kept alive connection as everything else
+    def doAction(self, action, torrents, location=None):
+        (method, arguments) = self.action_methods[action]
+        arguments = dict(arguments)
+        arguments["ids"] = [t.id for t in torrents]
+        if location is not None:
+            arguments["location"] = location
+        self.request(method, arguments)
+
+    # sends one rpc call, keeping the connection open for the next one
+    # transmission answers 409 with a new session id when ours is missing or
+    # old, in which case the call is repeated with that id
+    def request(self, method, arguments):
+        import json
+        import socket
+        try:
+            import httplib
+        except ImportError:
+            import http.client as httplib
+        body = json.dumps({"method": method, "arguments": arguments})
+        for attempt in range(3):
+            headers = {"Content-Type": "application/json"}
+            if self.session_id:
+                headers["X-Transmission-Session-Id"] = self.session_id
+            if self.auth:
+                headers["Authorization"] = self.auth
+            if self.connection is None:
+                self.connection = httplib.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request("POST", self.path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                #the daemon may have closed a kept alive connection, reconnect once
+                self.close()
+                if attempt > 0:
+                    raise RPCError("%s failed: can't reach %s:%d: %s" % (method, self.host, self.port, e))
+                continue
+            if response.status == 409:
+                self.session_id = response.getheader("X-Transmission-Session-Id")
+                continue
+            if response.status != 200:
+                self.close()
+                raise RPCError("%s returned HTTP %d" % (method, response.status))
+            try:
+                reply = json.loads(data.decode("utf-8"))
+            except ValueError:
+                raise RPCError("%s failed: transmission's answer isn't JSON" % method)
+            if reply.get("result") != "success":
+                raise RPCError("%s failed: %s" % (method, reply.get("result")))
+            return reply.get("arguments", dict())
+        raise RPCError("%s failed: no session id from transmission" % method)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class Torrent(object):
+    """Parses out torrent properties from a lines of output of transmission-remote"""
+    __slots__ = ["id", "percent", "eta", "eta_seconds", "up", "down", "ratio", "status", "name",
+                 "up_rate", "down_rate", "ratio_value", "endpoint", "stale", "raw_status", "left_bytes",
+                 "history_slot", "history", "details", "has_extra_data"]
+    # properties that only -e/--extradata fills in, kept in the details dict
+    # (None until then) rather than a slot each most torrents never use
+    extra_fields = ["location", "available", "size", "downloaded", "uploaded", "ratio_limit", "corrupt",
+                    "connected_to", "uploading_to", "downloading_from", "datetime_added", "datetime_started",
+                    "datetime_latest_activity", "public_torrent", "pieces", "piece_size"]
+    # the slots a template can show as they are, [:ID:] and so on. The rest
+    # are for working things out or aren't shown at all
+    template_fields = ["id", "percent", "eta", "eta_seconds", "up", "down", "ratio", "status"]
+    # every status transmission-remote shows
+    statuses = ["Downloading", "Seeding", "Up & Down", "Idle", "Stopped", "Finished", "Verifying", "Will Verify", "Queued"]
+    # what Endpoint saves of its torrents for the next run
+    saved_fields = ["id", "percent", "eta", "eta_seconds", "up", "down", "ratio", "status", "name",
+                    "up_rate", "down_rate", "ratio_value", "raw_status", "left_bytes"]
+    # what transmission's rpc status numbers mean, old (<2.40) and new numbering together
+    rpc_statuses = {0: "Stopped", 1: "Will Verify", 2: "Verifying", 3: "Queued", 4: "Active",
+                    5: "Queued", 6: "Active", 8: "Active", 16: "Stopped"}
+
+    # takes the column values of a transmission-remote -l line (a list or
+    # tuple), the line itself, or a dict from transmission's rpc torrent-get
+    def __init__(self, properties):
+        self.has_extra_data = False
+        self.endpoint = None
+        self.stale = False
+        self.left_bytes = self.history_slot = self.history = self.details = None
+        if type(properties) is tuple or type(properties) is list:
+            self.setValues(properties)
+        elif isinstance(properties, dict):
+            self.setRPCData(properties)
+        else:
+            self.setValues(splitLine(properties))
+        self.setNumbers()
+        self.raw_status = self.status
+        self.fixStatus(self.up_rate, self.down_rate)
+
+    # the values of saved_fields, for loadTorrent
+    def getSaved(self):
+        return tuple([getattr(self, name) for name in self.saved_fields])
+
+    # sets properties from the columns of transmission-remote -l
+    # (id, done, have, eta, up, down, ratio, status, name)
+    def setValues(self, values):
+        if len(values) < 9:
+            values = values + [None] * (9 - len(values))
+        (torrent_id, done, have, eta, self.up, self.down, self.ratio, self.status, self.name) = values[:9]
+        self.id = self.percent = self.eta = self.eta_seconds = None
+        if torrent_id:
+            self.id = int(torrent_id.strip("*"))
+        if done:
+            self.percent = int(done.strip("%"))
+        if eta:
+            self.setETA(eta)
+        if self.percent == 100:
+            self.left_bytes = 0.0
+        elif have and self.percent:
+            have = getSizeBytes(have)
+            if have is not None:
+                self.left_bytes = have * (100 - self.percent) / self.percent
+
+    # numbers for the speeds (KiB/s) and ratio, worked out once so sorting
+    # and fixStatus don't have to parse the strings again
+    def setNumbers(self):
+        self.up_rate = getNumber(self.up)
+        self.down_rate = getNumber(self.down)
+        self.ratio_value = getRatioValue(self.ratio)
+
+    # sets status from the one transmission reported and the given speeds
+    # (the latest ones, or smoothed ones with --history)
+    def fixStatus(self, up_rate, down_rate):
         #for some crazy reason, sometimes transmission-remote returns
         #the wrong status
-        if self.status == "Up & Down" and float(self.down) < 0.1:
-            self.status = "Seeding"
-        if self.status == "Up & Down" and float(self.up) < 0.1:
-            self.status = "Downloading"
-        if self.status == "Seeding" and float(self.up) < 0.1:
-            self.status = "Idle"
-        elif self.status == "Downloading" and float(self.down) < 0.1:
-            self.status = "Idle"
+        status = self.raw_status
+        if status == "Up & Down" and down_rate < 0.1:
+            status = "Seeding"
+        if status == "Up & Down" and up_rate < 0.1:
+            status = "Downloading"
+        if status == "Seeding" and up_rate < 0.1:
+            status = "Idle"
+        elif status == "Downloading" and down_rate < 0.1:
+            status = "Idle"
+        self.status = status
             
-    def setExtraData(self, data):
+    # reads this torrent's part of the extra data fetched for every torrent,
+    # rpc fields or lines of transmission-remote -i
+    def setExtraData(self, extra_data):
+        if self.endpoint is None:
+            data = extra_data.get(self.id)
+        else:
+            data = extra_data.get((self.endpoint, self.id))
+        if data is None:
+            return
+        self.has_extra_data = True
+        if self.details is None:
+            self.details = dict()
+        if isinstance(data, dict):
+            self.setRPCData(data)
+            return
         for l in data:
-            if self.setLocation(l): continue
-            if self.setAvailable(l): continue
-            if self.setSize(l): continue
-            if self.setDownloaded(l): continue
-            if self.setUploaded(l): continue
-            if self.setRatioLimit(l): continue
-            if self.setCorrupt(l): continue
-            if self.setPeers(l): continue
-            if self.setDateAdded(l): continue
-            if self.setDateStarted(l): continue
-            if self.setLatestActivity(l): continue
-            if self.setPublicTorrent(l): continue
-            if self.setPieces(l): continue
-            if self.setPieceSize(l): continue
-
-    def getValue(self, line, remove):
-        return line.replace(remove, "").strip()
-            
-    def setLocation(self, line):
-        if self.location == None:
-            if line.find("Location:") >= 0:
-                self.location = self.getValue(line, "Location: ")
-                return True       
+            (key, colon, value) = l.partition(":")
+            if colon:
+                setter = self.detail_setters.get(key.strip())
+                if setter is not None:
+                    setter(self, value.strip())
+
+    # sets whichever properties are present in a torrent from rpc torrent-get,
+    # formatted the way transmission-remote prints them
+    def setRPCData(self, data):
+        if "id" in data:
+            self.id = data["id"]
+        if "name" in data:
+            self.name = data["name"]
+        if "percentDone" in data:
+            self.percent = int(data["percentDone"] * 100)
+        if "eta" in data:
+            if data.get("leftUntilDone") or data["eta"] != -1:
+                self.setETA(getETAString(data["eta"]))
+            else:
+                self.setETA("Done")
+        if "leftUntilDone" in data:
+            self.left_bytes = data["leftUntilDone"]
+        if "rateUpload" in data:
+            self.up = getKBps(data["rateUpload"])
+        if "rateDownload" in data:
+            self.down = getKBps(data["rateDownload"])
+        if "uploadRatio" in data:
+            self.ratio = getRatioString(data["uploadRatio"])
+        if "status" in data:
+            self.status = self.rpc_statuses.get(data["status"], "Unknown")
+            if self.status == "Stopped" and data.get("isFinished"):
+                self.status = "Finished"
+            elif self.status == "Active":
+                uploading = data.get("peersGettingFromUs")
+                downloading = data.get("peersSendingToUs")
+                if uploading and downloading:
+                    self.status = "Up & Down"
+                elif downloading:
+                    self.status = "Downloading"
+                elif uploading:
+                    self.status = "Seeding"
+                else:
+                    self.status = "Idle"
+        if self.details is None:
+            #the peer counts come with the list fields, before any extra data
+            self.details = dict()
+        if "downloadDir" in data:
+            self.details["location"] = data["downloadDir"]
+        if "desiredAvailable" in data and data.get("sizeWhenDone"):
+            have = data["sizeWhenDone"] - data["leftUntilDone"]
+            #transmission formats percentages the same way as ratios
+            self.details["available"] = getRatioString(100.0 * (have + data["desiredAvailable"]) / data["sizeWhenDone"]) + "%"
+        if "sizeWhenDone" in data:
+            self.details["size"] = getSizeString(data["sizeWhenDone"])
+        if "downloadedEver" in data:
+            self.details["downloaded"] = getSizeString(data["downloadedEver"])
+        if "uploadedEver" in data:
+            self.details["uploaded"] = getSizeString(data["uploadedEver"])
+        if "seedRatioMode" in data:
+            if data["seedRatioMode"] == 1:
+                self.details["ratio_limit"] = getRatioString(data["seedRatioLimit"])
+            elif data["seedRatioMode"] == 2:
+                self.details["ratio_limit"] = "Unlimited"
+            else:
+                self.details["ratio_limit"] = "Default"
+        if "corruptEver" in data:
+            if data["corruptEver"]:
+                self.details["corrupt"] = getSizeString(data["corruptEver"])
+            else:
+                self.details["corrupt"] = "None"
+        if "peersConnected" in data:
+            self.details["connected_to"] = str(data["peersConnected"])
+        if "peersGettingFromUs" in data:
+            self.details["uploading_to"] = str(data["peersGettingFromUs"])
+        if "peersSendingToUs" in data:
+            self.details["downloading_from"] = str(data["peersSendingToUs"])
+        if data.get("addedDate"):
+            self.details["datetime_added"] = timestamp_cache.get(data["addedDate"])
+        if data.get("startDate"):
+            self.details["datetime_started"] = timestamp_cache.get(data["startDate"])
+        if data.get("activityDate"):
+            self.details["datetime_latest_activity"] = timestamp_cache.get(data["activityDate"])
+        if "isPrivate" in data:
+            if data["isPrivate"]:
+                self.details["public_torrent"] = "No"
+            else:
+                self.details["public_torrent"] = "Yes"
+        if "pieceCount" in data:
+            self.details["pieces"] = str(data["pieceCount"])
+        if "pieceSize" in data:
+            self.details["piece_size"] = getSizeString(data["pieceSize"], ["B", "KiB", "MiB", "GiB"])
+
+    def setLocation(self, value):
+        self.details["location"] = value
     
-    def setAvailable(self, line):
-        if self.available == None:
-            if line.find("Availability:") >= 0:
-                self.available = self.getValue(line, "Availability: ")
-                return True
+    def setAvailable(self, value):
+        self.details["available"] = value
                 
-    def setSize(self, line):
-        if self.size == None:
-            if line.find("Total size:") >= 0:
-                idx1 = line.find("(")
-                idx2 = line.find(")")
-                self.size = line[idx1+1:idx2].replace(" wanted", '')
-                return True
+    # Total size: 689.3 MB (689.3 MB wanted)
+    def setSize(self, value):
+        self.details["size"] = value[value.find("(")+1:value.find(")")].replace(" wanted", '')
             
-    def setDownloaded(self, line):
-        if self.downloaded == None:
-            if line.find("Downloaded:") >= 0:
-                self.downloaded = self.getValue(line, "Downloaded: ")
-                return True
-
-    def setUploaded(self, line):
-        if self.uploaded == None:
-            if line.find("Uploaded:") >= 0:
-                self.uploaded = self.getValue(line, "Uploaded: ")
-                return True
+    def setDownloaded(self, value):
+        self.details["downloaded"] = value
+
+    def setUploaded(self, value):
+        self.details["uploaded"] = value
             
-    def setRatioLimit(self, line):
-        if self.ratio_limit == None:
-            if line.find("Ratio Limit:") >= 0:
-                self.ratio_limit = self.getValue(line, "Ratio Limit: ")
-                return True
+    def setRatioLimit(self, value):
+        self.details["ratio_limit"] = value
             
-    def setCorrupt(self, line):
-        if self.corrupt == None:
-            if line.find("Corrupt DL:") >= 0:
-                self.corrupt = self.getValue(line, "Corrupt DL: ")
-                return True
+    def setCorrupt(self, value):
+        self.details["corrupt"] = value
             
-    def setPeers(self, line):
-        if self.connected_to == None:
-            if line.find("Peers:") >= 0:
-                peers = self.getValue(line, "Peers: ").split(", ")
-                self.connected_to = peers[0].replace("connected to ", '').strip()
-                self.uploading_to = peers[0].replace("uploading to ", '').strip()
-                self.downloading_from = peers[0].replace("downloading from ", '').strip()
-                return True
+    # Peers: connected to 40, uploading to 3, downloading from 12
+    def setPeers(self, value):
+        peers = value.split(", ")
+        self.details["connected_to"] = peers[0].replace("connected to ", '').strip()
+        if len(peers) == 3:
+            self.details["uploading_to"] = peers[1].replace("uploading to ", '').strip()
+            self.details["downloading_from"] = peers[2].replace("downloading from ", '').strip()
                 
-    def setDateAdded(self, line):
-        if self.datetime_added == None:
-            if line.find("Date added:") >= 0:
-                self.datetime_added = datetime.strptime(self.getValue(line, "Date added: "), "%a %b %d %H:%M:%S %Y")
-                return True
-
-    def setDateStarted(self, line):
-        if self.datetime_started == None:
-            if line.find("Date started:") >= 0:
-                self.datetime_started = datetime.strptime(self.getValue(line, "Date started: "), "%a %b %d %H:%M:%S %Y")
-                return True
+    def setDateAdded(self, value):
+        self.details["datetime_added"] = date_cache.get(value)
+
+    def setDateStarted(self, value):
+        self.details["datetime_started"] = date_cache.get(value)
         
-    def setLatestActivity(self, line):
-        if self.datetime_latest_activity == None:
-            if line.find("Latest activity:") >= 0:
-                self.datetime_latest_activity = datetime.strptime(self.getValue(line, "Latest activity: "), "%a %b %d %H:%M:%S %Y")
-                return True
+    def setLatestActivity(self, value):
+        self.details["datetime_latest_activity"] = date_cache.get(value)
     
-    def setPublicTorrent(self, line):
-        if self.public_torrent == None:
-            if line.find("Public torrent:") >= 0:
-                self.public_torrent = self.getValue(line, "Public torrent: ")
-                return True
+    def setPublicTorrent(self, value):
+        self.details["public_torrent"] = value
                 
-    def setPieces(self, line):
-        if self.pieces == None:
-            if line.find("Piece Count:") >= 0:
-                self.pieces = self.getValue(line, "Piece Count: ")
-                return True
+    def setPieces(self, value):
+        self.details["pieces"] = value
     
-    def setPieceSize(self, line):
-        if self.piece_size == None:
-            if line.find("Piece Size:") >= 0:
-                self.piece_size = self.getValue(line, "Piece Size: ")
-                return True
+    def setPieceSize(self, value):
+        self.details["piece_size"] = value
 
-    # sets id of torrent
-    def setId(self, str):
-        self.id = int(str.strip("*"))
+    # transmission-remote -i name (before the colon): setter for its value
+    detail_setters = {
+        "Location": setLocation,
+        "Availability": setAvailable,
+        "Total size": setSize,
+        "Downloaded": setDownloaded,
+        "Uploaded": setUploaded,
+        "Ratio Limit": setRatioLimit,
+        "Corrupt DL": setCorrupt,
+        "Peers": setPeers,
+        "Date added": setDateAdded,
+        "Date started": setDateStarted,
+        "Latest activity": setLatestActivity,
+        "Public torrent": setPublicTorrent,
+        "Piece Count": setPieces,
+        "Piece Size": setPieceSize,
+    }
 
-    # sets percent downloaded
-    def setPercent(self, str):
-        self.percent = int(str.strip("%"))
+    # one of extra_fields, None if it hasn't been got
+    def getDetail(self, name):
+        if self.details is None:
+            return None
+        return self.details.get(name)
 
     # sets estimated time left
     def setETA(self, str):
@@ -382,23 +1651,55 @@ class Torrent:
             self.eta = "?"
         else:
             self.eta = str
-        self.setETASeconds(str)    
+        self.eta_seconds = eta_cache.get(str)
             
-    #sets the ETA in seconds (so we can sort them by eta)
-    def setETASeconds(self, eta):
-        if eta.find("secs") > 0:
-            self.eta_seconds = int(eta.strip(' secs'))
-        elif eta.find("min") > 0:
-            self.eta_seconds = 60 * int(eta.strip(' mins'))
-        elif eta.find("hrs")  > 0:
-            self.eta_seconds = 3600 * int(eta.strip(' hrs'))
-        elif eta.find("days")  > 0:
-            self.eta_seconds = 86400 * int(eta.strip(' days'))
-        elif eta == "Done":
-            self.eta_seconds = 0
+class Descending(object):
+    """Wraps a sort key so it sorts the other way round"""
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class Template:
+    """A template split once into literal text and [:VARIABLE:] slots, so
+    rendering is a single join over the variables it actually uses"""
+    placeholder = r"(\[:[A-Z_&]+:\])"
+
+    # compiled is the result of an earlier getCompiled(), to skip parsing text again
+    def __init__(self, text, compiled=None):
+        self.text = text
+        if compiled:
+            (self.head, self.slots) = compiled
         else:
-            self.eta_seconds = 9999999999999999
-            
+            import re
+            parts = re.split(self.placeholder, text)
+            self.head = parts[0]
+            # (variable name, placeholder text, literal text up to the next variable)
+            self.slots = [(parts[i][2:-2].lower(), parts[i], parts[i+1]) for i in range(1, len(parts), 2)]
+        self.fields = set([slot[0] for slot in self.slots])
+
+    # returns the parsed template as plain data that marshal can store
+    def getCompiled(self):
+        return (self.head, self.slots)
+
+    # fills in the template, asking get_value for each variable by its lower case
+    # name. Variables get_value returns None for are left as they are
+    def render(self, get_value):
+        out = [self.head]
+        for (name, placeholder, literal) in self.slots:
+            value = get_value(name)
+            if value is None:
+                value = placeholder
+            out.append(value)
+            out.append(literal)
+        return "".join(out)
+
 class TemplateWriter:
     """Finds and writes to the templates"""
     config = None
@@ -408,58 +1709,169 @@ class TemplateWriter:
     torrent_default = None
     loaded_templates = dict()
     missing_templates = list()
+    # True until the first reset(), which has nothing to forget yet
+    fresh = False
     globals_output = ""
     torrent_output = ""
+    # with --incremental, (endpoint, torrent id, stale): (Torrent, template text,
+    # status, history and extra data shown, rendered text)
+    fragments = None
+    # with --incremental, the last output and what it was made from
+    last_output = None
+    # template variables from the speed history, [:UP_SMOOTH:] etc.
+    # (and [:G_UP_SMOOTH:] etc. for the totals)
+    history_fields = ["up_smooth", "down_smooth", "up_avg", "down_avg", "up_spark", "down_spark"]
     
     def __init__(self, config):
         self.config = config
+        self.fragments = dict()
+        self.loaded_templates = dict()
+        self.missing_templates = list()
+        self.extra_fields = dict()
         if config.template_folder:
             self.path = config.template_folder
         else:
             self.path = config.base_path+"/templates"
+        self.cache = TemplateCache(self.path, config.cache_dir)
+        if not self.getCriticalTemplates():
+            raise Exception("Critical templates missing!")
+        self.fresh = True
+    
+    # forgets the output of the last render, and which templates were
+    # loaded so edited templates are picked up by the next one
+    def reset(self):
+        if self.fresh:
+            #nothing rendered or loaded since __init__ did the same
+            self.fresh = False
+            return
+        self.globals_output = ""
+        self.torrent_output = ""
+        self.loaded_templates = dict()
+        self.missing_templates = list()
+        self.extra_fields = dict()
         if not self.getCriticalTemplates():
             raise Exception("Critical templates missing!")
     
     def getCriticalTemplates(self):
-        path = self.path
-        self.layout = getFile(path+"/layout.template")
-        self.globals_template = getFile(path+"/globals.template")
-        self.torrent_default = getFile(path+"/torrent_default.template")
+        self.layout = self.cache.getTemplate("layout.template")
+        self.globals_template = self.cache.getTemplate("globals.template")
+        self.torrent_default = self.cache.getTemplate("torrent_default.template")
         if(self.layout and self.globals_template and self.torrent_default):
             return True
         else:
             return False
+
+    # returns which of Torrent.extra_fields the template for status uses
+    def getExtraFields(self, status):
+        try:
+            return self.extra_fields[status]
+        except KeyError:
+            fields = self.getTorrentTemplate(status).fields
+            self.extra_fields[status] = fields.intersection(Torrent.extra_fields)
+            return self.extra_fields[status]
             
     def getOutput(self):
         if self.torrent_output != "":
-            template = self.layout
-            template = template.replace("[:TORRENTS:]", self.torrent_output.rstrip("\n"))
-            template = template.replace("[:GLOBALS:]", self.globals_output.rstrip("\n"))
-            return template
+            key = (self.layout.text, self.torrent_output, self.globals_output)
+            if self.last_output is not None and self.last_output[0] == key:
+                return self.last_output[1]
+            values = {"torrents": self.torrent_output.rstrip("\n"), "globals": self.globals_output.rstrip("\n")}
+            output = self.layout.render(values.get)
+            if self.config.incremental:
+                self.last_output = (key, output)
+            return output
         else:
             return ""
             
-    def getGlobalsOutput(self, up, down):
-        template = self.globals_template
-        template = template.replace("[:G_UP:]", self.getSpeed(up))
-        template = template.replace("[:G_UP_KBPS:]", str(up))
-        template = template.replace("[:G_DOWN:]", self.getSpeed(down))
-        template = template.replace("[:G_DOWN_KBPS:]", str(down))
-        self.globals_output = template        
+    # history is SpeedHistory.getValues for the totals, or None
+    def getGlobalsOutput(self, up, down, history=None):
+        values = {"g_up": self.getSpeed(up), "g_up_kbps": str(up),
+                  "g_down": self.getSpeed(down), "g_down_kbps": str(down)}
+        for name in self.history_fields:
+            values["g_" + name] = self.getHistoryValue(history, name, getNumber(up), getNumber(down))
+        self.globals_output = self.globals_template.render(values.get)
     
     def getTorrentOutput(self, torrents):
+        output = list()
+        fragments = dict()
         for torrent in torrents:
-            template = self.getTorrentTemplate(torrent)
-            torrent.name = torrent.name[:self.config.name_length]
-            for p, v in torrent.__dict__.iteritems():
-                template = template.replace("[:"+p.upper()+":]", str(v))
-            template = template.replace("[:UP_KBPS:]", str(getSpeed(torrent.up, self.config.m_unit, self.config.k_unit)))
-            template = template.replace("[:DOWN_KBPS:]", str(getSpeed(torrent.down, self.config.m_unit, self.config.k_unit)))
-            #add additional template things here!
-            self.torrent_output+=template        
+            template = self.getTorrentTemplate(torrent.status)
+            #torrents the backend handed back unchanged can reuse their last text
+            key = (torrent.endpoint, torrent.id, torrent.stale)
+            fragment = self.fragments.get(key)
+            state = (torrent.status, torrent.history)
+            if self.config.extra_data:
+                #extra data is fetched again every refresh, it may have changed
+                #while the rest of the torrent didn't
+                state = state + tuple([torrent.getDetail(f) for f in self.getExtraFields(torrent.status)])
+            if fragment is not None and fragment[0] is torrent and fragment[1] == template.text and fragment[2] == state:
+                text = fragment[3]
+            else:
+                text = template.render(partial(self.getTorrentValue, torrent))
+            if self.config.incremental:
+                fragments[key] = (torrent, template.text, state, text)
+            output.append(text)
+        self.fragments = fragments
+        self.torrent_output = self.torrent_output + "".join(output)
+
+    # returns the text for one torrent template variable,
+    # or None if the torrent doesn't have it
+    def getTorrentValue(self, torrent, name):
+        if name == "name":
+            return torrent.name[:self.config.name_length]
+        elif name == "up_kbps":
+            return self.getSpeed(torrent.up)
+        elif name == "down_kbps":
+            return self.getSpeed(torrent.down)
+        elif name == "endpoint":
+            return torrent.endpoint or ""
+        elif name == "stale":
+            if torrent.stale:
+                return "stale"
+            return ""
+        elif name in self.history_fields:
+            return self.getHistoryValue(torrent.history, name, torrent.up_rate, torrent.down_rate)
+        elif name == "eta_smooth":
+            return self.getSmoothETA(torrent)
+        #add additional template things here!
+        elif name in Torrent.template_fields:
+            value = getattr(torrent, name)
+        elif name in Torrent.extra_fields:
+            value = torrent.getDetail(name)
+        else:
+            return None
+        if value is None:
+            return None
+        return str(value)
         
-    def getTorrentTemplate(self, torrent):
-        template_name = "torrent_"+torrent.status.lower().replace(" ","_")
+    # one of history_fields from SpeedHistory.getValues, falling back on
+    # the latest speeds without any history
+    def getHistoryValue(self, history, name, up, down):
+        if history is None:
+            history = (up, down, [], [])
+        (direction, kind) = name.split("_")
+        if direction == "up":
+            (smooth, samples, latest) = (history[0], history[2], up)
+        else:
+            (smooth, samples, latest) = (history[1], history[3], down)
+        if kind == "smooth":
+            return self.getSpeed(smooth)
+        elif kind == "avg":
+            #the samples are 32 bit floats, 4.2 comes back as 4.1999998,
+            #which getSpeed would cut to 4.1
+            if samples:
+                latest = round(sum(samples) / len(samples), 3)
+            return self.getSpeed(latest)
+        return getSparkline(samples)
+
+    # time left at the smoothed download speed
+    def getSmoothETA(self, torrent):
+        if torrent.history is None or not torrent.left_bytes or torrent.history[1] < 0.1:
+            return torrent.eta
+        return getETAString(int(torrent.left_bytes / (torrent.history[1] * 1024)))
+
+    def getTorrentTemplate(self, status):
+        template_name = "torrent_"+status.lower().replace(" ","_")
         try:
             template = self.loaded_templates[template_name]
         except KeyError:
@@ -467,7 +1879,7 @@ class TemplateWriter:
                 self.missing_templates.index(template_name)
             except ValueError:
                 filename = template_name+".template"
-                template = getFile(self.path+"/"+filename)
+                template = self.cache.getTemplate(filename)
                 if not template:
                     self.missing_templates.append(template_name)
                     return self.torrent_default
@@ -480,39 +1892,856 @@ class TemplateWriter:
             return template
             
     def getSpeed(self, v):
-        return getSpeed(v, self.config.m_unit, self.config.k_unit)
+        return speed_cache.get(v, self.config.m_unit, self.config.k_unit)
     
+class TemplateCache:
+    """Keeps parsed templates on disk between runs, checked against each
+    file's mtime and size, so a warm start only has to stat() them"""
+    folder = None
+    path = None
+    entries = None
+    changed = False
+
+    def __init__(self, folder, cache_dir):
+        self.folder = os.path.abspath(os.path.expanduser(folder))
+        self.entries = dict()
+        if cache_dir:
+            name = "templates-%08x.cache" % getCRC(self.folder)
+            self.path = os.path.join(os.path.expanduser(cache_dir), name)
+            self.load()
+
+    def load(self):
+        try:
+            fileinput = open(self.path, "rb")
+            try:
+                (folder, entries) = marshal.load(fileinput)
+            finally:
+                fileinput.close()
+        except Exception:
+            return
+        #two folders could share a crc
+        if folder == self.folder:
+            self.entries = entries
+
+    # writes the cache out if anything in it changed
+    def save(self):
+        if not self.changed or not self.path:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+            fileoutput = open(tmp_path, "wb")
+            marshal.dump((self.folder, self.entries), fileoutput)
+            fileoutput.close()
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            return
+        self.changed = False
+
+    # returns the Template for a file in the folder, or False if there isn't one
+    # missing templates are cached too, until the file shows up
+    def getTemplate(self, filename):
+        try:
+            stat = os.stat(os.path.join(self.folder, filename))
+        except OSError:
+            signature = None
+        else:
+            signature = (stat.st_mtime, stat.st_size)
+        entry = self.entries.get(filename)
+        if entry is not None and entry[0] == signature:
+            if entry[1] is None:
+                return False
+            return Template(entry[1], entry[2])
+        template = False
+        if signature is not None:
+            template = getTemplate(os.path.join(self.folder, filename))
+        if template:
+            self.entries[filename] = (signature, template.text, template.getCompiled())
+        else:
+            self.entries[filename] = (signature, None, None)
+        self.changed = True
+        return template
+
+class RenderCache:
+    """Keeps the last good output on disk between runs, with when it was
+    made and how many refreshes have failed since, for --timeout-ms and --maxage"""
+    # seconds to wait after the first failed refresh, doubling with each
+    # one after that, up to backoff_max
+    backoff_start = 1.0
+    backoff_max = 300.0
+    key = None
+    path = None
+    lock_file = None
+    output = ""
+    time = None
+    failures = 0
+    retry_at = 0
+
+    # key tells apart the outputs of different command lines
+    def __init__(self, cache_dir, key):
+        self.key = key
+        name = "render-%08x" % getCRC(key)
+        self.path = os.path.join(os.path.expanduser(cache_dir), name)
+        self.load()
+
+    def load(self):
+        try:
+            fileinput = open(self.path + ".cache", "rb")
+            try:
+                (key, output, made, failures, retry_at) = marshal.load(fileinput)
+            finally:
+                fileinput.close()
+        except Exception:
+            return
+        #two command lines could share a crc
+        if key == self.key:
+            (self.output, self.time, self.failures, self.retry_at) = (output, made, failures, retry_at)
+
+    def save(self):
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+            fileoutput = open(tmp_path, "wb")
+            marshal.dump((self.key, self.output, self.time, self.failures, self.retry_at), fileoutput)
+            fileoutput.close()
+            os.rename(tmp_path, self.path + ".cache")
+        except (IOError, OSError):
+            pass
+
+    # takes the lock only one refresh at a time can hold, without waiting
+    # for it. It is let go when every process holding it has exited
+    def lock(self):
+        import fcntl
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self.lock_file = open(self.path + ".lock", "w")
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        return True
+
+    # is a refresh going on right now?
+    def isLocked(self):
+        if not self.lock():
+            return True
+        self.lock_file.close()
+        self.lock_file = None
+        return False
+
+    # is it too soon after a failure to try again?
+    def isBackingOff(self):
+        return time.time() < self.retry_at
+
+    # the last good output, [:STALE_SECS:] filled in
+    def getOutput(self):
+        if self.time is None:
+            return self.output
+        return setStaleSecs(self.output, time.time() - self.time)
+
+    def setOutput(self, output):
+        self.output = output
+        self.time = time.time()
+        self.failures = 0
+        self.retry_at = 0
+        self.save()
+
+    def setFailed(self):
+        self.failures = self.failures + 1
+        self.retry_at = time.time() + getBackoff(self.failures, self.backoff_start, self.backoff_max)
+        self.save()
+
+class StageTimer:
+    """Adds up the wall time and number of calls of each stage of a refresh,
+    for --timings and the [:T_*:] template variables"""
+    stages = ["fetch", "parse", "history", "filter", "sort", "enrich", "render", "output"]
+    times = None
+    calls = None
+    # output is done after the refresh is rendered, so [:T_OUTPUT:]
+    # shows how long the one before took
+    last_output = 0.0
+
+    def __init__(self):
+        self.reset()
+
+    # starts over for a new refresh
+    def reset(self):
+        if self.times:
+            self.last_output = self.times["output"]
+        self.times = dict.fromkeys(self.stages, 0.0)
+        self.calls = dict.fromkeys(self.stages, 0)
+
+    # adds the time since started to stage
+    def add(self, stage, started):
+        self.addElapsed(stage, time.time() - started)
+
+    # adds seconds timed some other way (a stage run a torrent at a time) to stage
+    def addElapsed(self, stage, elapsed):
+        self.times[stage] = self.times[stage] + elapsed
+        self.calls[stage] = self.calls[stage] + 1
+
+    # adds the times and calls of another timer, one nothing is adding to any more
+    def addTimer(self, other):
+        for stage in self.stages:
+            self.times[stage] = self.times[stage] + other.times[stage]
+            self.calls[stage] = self.calls[stage] + other.calls[stage]
+
+    def getTotal(self):
+        return sum(self.times.values())
+
+    # fills in [:T_FETCH:] etc. in milliseconds
+    def setTimings(self, output):
+        if "[:T_" not in output:
+            return output
+        for stage in self.stages:
+            if stage != "output":
+                output = output.replace("[:T_%s:]" % stage.upper(), "%.1f" % (self.times[stage] * 1000))
+        output = output.replace("[:T_OUTPUT:]", "%.1f" % (self.last_output * 1000))
+        return output.replace("[:T_TOTAL:]", "%.1f" % (self.getTotal() * 1000))
+
+    # adds a line of JSON with the times (in milliseconds) and calls to path
+    def log(self, path, torrents):
+        import json
+        times = dict([(stage, round(self.times[stage] * 1000, 3)) for stage in self.stages])
+        #the conversion caches count from the start, not for each refresh
+        caches = dict([(name, {"hits": cache.hits, "misses": cache.misses}) for (name, cache) in conversion_caches.items()])
+        line = json.dumps({"time": round(time.time(), 3), "torrents": torrents, "total_ms": round(self.getTotal() * 1000, 3),
+                           "stages_ms": times, "calls": self.calls, "caches": caches}, sort_keys=True)
+        try:
+            fileoutput = open(os.path.expanduser(path), "a")
+            try:
+                fileoutput.write(line + "\n")
+            finally:
+                fileoutput.close()
+        except IOError as e:
+            sys.stderr.write("conkytransmission: can't write timings: %s\n" % e)
+
+class ConversionCache:
+    """Remembers what a conversion gave for the last size or so inputs it
+    was asked about, counting how often it was asked about one again (hits)
+    or a new one (misses). The inputs not asked about for longest are dropped
+    half of size at a time, two dicts instead of reordering one on every hit"""
+    size = 2048
+    hits = 0
+    misses = 0
+    convert = None
+    # the inputs asked about since the last half was dropped, and before
+    recent = None
+    older = None
+
+    def __init__(self, convert, size=None):
+        self.convert = convert
+        if size:
+            self.size = size
+        self.recent = dict()
+        self.older = dict()
+
+    # convert(*key), worked out again only if it isn't remembered
+    def get(self, *key):
+        try:
+            value = self.recent[key]
+        except KeyError:
+            pass
+        else:
+            self.hits = self.hits + 1
+            return value
+        if key in self.older:
+            value = self.older[key]
+            self.hits = self.hits + 1
+        else:
+            value = self.convert(*key)
+            self.misses = self.misses + 1
+        if len(self.recent) >= self.size // 2:
+            self.older = self.recent
+            self.recent = dict()
+        self.recent[key] = value
+        return value
+
+class SpeedHistory:
+    """The last few up/down speeds of each torrent and of the totals, in
+    ring buffers of fixed size packed into one block of memory, or a
+    memory mapped file so runs from conky can add to it in turn (holding
+    a lock on it while they do). Slots
+    are reused least recently used first, so memory stays the same
+    however many torrents come and go"""
+    slot_count = 1024
+    sample_count = 30
+    # samples closer together than this are taken as the same one
+    min_interval = 0.5
+    magic = b"CTSH"
+    header = struct.Struct("<4sHH")
+    # how many times slots have been given out, after the header, so runs
+    # sharing the file know when to read the index again
+    changes = struct.Struct("<I")
+    # key crc, time of last sample, smoothed up, smoothed down,
+    # where the next sample goes, how many samples there are
+    slot_header = struct.Struct("<IdddHH")
+    sample = struct.Struct("<ff")
+    data = None
+    # key crc: slot, for the slots in use
+    index = None
+    # (time of last sample, slot) for each slot in use, as a heap. Later
+    # samples don't update it, getFreeSlot puts a slot back in with its
+    # real time when it turns out to have moved on
+    ages = None
+    # slots not in use
+    free = None
+    # the changes count index was read at
+    seen_changes = 0
+    # the open history file, None when it is kept in memory
+    fd = None
+
+    # path is the file to keep the history in, None to keep it in memory
+    # smoothing is the time constant of the smoothed speeds, in seconds
+    def __init__(self, path, smoothing):
+        self.smoothing = max(smoothing, 0.001)
+        self.slot_size = self.slot_header.size + self.sample_count * self.sample.size
+        size = self.header.size + self.changes.size + self.slot_count * self.slot_size
+        header = self.header.pack(self.magic, self.slot_count, self.sample_count)
+        if path is not None:
+            try:
+                self.data = self.openFile(path, size, header)
+            except EnvironmentError:
+                self.data = None
+        if self.data is None:
+            self.data = bytearray(size)
+            self.data[:len(header)] = header
+        self.loadIndex()
+
+    def loadIndex(self):
+        self.index = dict()
+        self.ages = list()
+        self.free = list()
+        for slot in range(self.slot_count - 1, -1, -1):
+            (key, last_time) = self.slot_header.unpack_from(self.data, self.getOffset(slot))[:2]
+            if last_time:
+                self.index[key] = slot
+                self.ages.append((last_time, slot))
+            else:
+                self.free.append(slot)
+        heapq.heapify(self.ages)
+        self.seen_changes = self.changes.unpack_from(self.data, self.header.size)[0]
+
+    # maps the history file, starting it over if it was made with
+    # different sizes. The file is kept open for lock()
+    def openFile(self, path, size, header):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        import fcntl
+        import mmap
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != size or os.read(fd, len(header)) != header:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, header)
+            data = mmap.mmap(fd, size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(fd)
+            raise
+        self.fd = fd
+        return data
+
+    # waits for any other run adding to the history file to finish, and
+    # keeps them out until unlock(). If they gave out slots since, the
+    # index is read back in, so two runs never hand out the same one
+    def lock(self):
+        if self.fd is not None:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            if self.changes.unpack_from(self.data, self.header.size)[0] != self.seen_changes:
+                self.loadIndex()
+
+    def unlock(self):
+        if self.fd is not None:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def getOffset(self, slot):
+        return self.header.size + self.changes.size + slot * self.slot_size
+
+    # adds a sample to key's history, giving it a slot if it hasn't got
+    # one, unless both speeds are 0 and keep is False, or every slot has
+    # had a sample this refresh (keep takes one anyway)
+    # returns the slot, or None
+    def addSample(self, key, up, down, now, keep=False):
+        crc = getCRC(key)
+        slot = self.index.get(crc)
+        if slot is None:
+            if not (up or down or keep):
+                return None
+            slot = self.getFreeSlot(now, keep)
+            if slot is None:
+                return None
+            self.index[crc] = slot
+            heapq.heappush(self.ages, (now, slot))
+            self.slot_header.pack_into(self.data, self.getOffset(slot), crc, 0, up, down, 0, 0)
+            self.seen_changes = (self.seen_changes + 1) & 0xffffffff
+            self.changes.pack_into(self.data, self.header.size, self.seen_changes)
+        offset = self.getOffset(slot)
+        (crc, last_time, up_smooth, down_smooth, position, count) = self.slot_header.unpack_from(self.data, offset)
+        if count and now - last_time < self.min_interval:
+            return slot
+        #exponentially weighted, by how long it has been since the last sample
+        weight = 1.0
+        if count:
+            weight = 1.0 - getDecay(now - last_time, self.smoothing)
+        up_smooth = up_smooth + weight * (up - up_smooth)
+        down_smooth = down_smooth + weight * (down - down_smooth)
+        self.sample.pack_into(self.data, offset + self.slot_header.size + position * self.sample.size, up, down)
+        position = (position + 1) % self.sample_count
+        count = min(count + 1, self.sample_count)
+        self.slot_header.pack_into(self.data, offset, crc, now, up_smooth, down_smooth, position, count)
+        return slot
+
+    # an unused slot, or the one that has gone longest without a sample,
+    # None if that one has had a sample this refresh too (unless keep)
+    def getFreeSlot(self, now, keep=False):
+        if self.free:
+            return self.free.pop()
+        ages = self.ages
+        while ages:
+            (last_time, slot) = ages[0]
+            (key, real_time) = self.slot_header.unpack_from(self.data, self.getOffset(slot))[:2]
+            if real_time != last_time:
+                heapq.heapreplace(ages, (real_time, slot))
+            elif now - last_time < self.min_interval and not keep:
+                return None
+            else:
+                heapq.heappop(ages)
+                self.index.pop(key, None)
+                return slot
+        return None
+
+    # returns (smoothed up, smoothed down)
+    def getSmoothed(self, slot):
+        return self.slot_header.unpack_from(self.data, self.getOffset(slot))[2:4]
+
+    # returns (smoothed up, smoothed down, up samples, down samples),
+    # samples oldest first
+    def getValues(self, slot):
+        offset = self.getOffset(slot)
+        (crc, last_time, up_smooth, down_smooth, position, count) = self.slot_header.unpack_from(self.data, offset)
+        offset = offset + self.slot_header.size
+        ups = list()
+        downs = list()
+        for i in range(position - count, position):
+            (up, down) = self.sample.unpack_from(self.data, offset + (i % self.sample_count) * self.sample.size)
+            ups.append(up)
+            downs.append(down)
+        return (up_smooth, down_smooth, ups, downs)
+
 # function formatting KiB/s output by transmission into
-# a human readable but succinct format
+# a human readable but succinct format, one decimal (cut, not rounded)
+# and MiB/s once that shows 1024 KiB/s or more. Not a number at all shows as ?
+# (use speed_cache rather than calling it for every torrent)
 def getSpeed(str, m_unit, k_unit):
     kbps = float(str)
-    if kbps > 1024:
-        speed = `round(float(kbps/1024), 2)`
-        unit = m_unit
+    if kbps != kbps or kbps in (float("inf"), float("-inf")):
+        return "? " + k_unit
+    shown = getTenths(kbps)
+    if abs(shown) >= 1024:
+        return "%.1f %s" % (getTenths(kbps / 1024), m_unit)
+    return "%.1f %s" % (shown, k_unit)
+
+# cuts a number to one decimal. A millionth is added first, so a number
+# that is only a hair short of a tenth (floats can't hold most tenths
+# exactly) keeps it
+def getTenths(number):
+    if number < 0:
+        return -getTenths(-number)
+    return int(number * 10 + 0.000001) / 10.0
+
+# reads a file of comma separated keywords, spaces and line breaks ignored
+def getKeywordList(path):
+    if path:
+        filtertext = getFile(path)
+        if filtertext:
+            filtertext = filtertext.replace(' ','').replace('\n','')
+            return [w for w in filtertext.split(",") if w != '']
+    return list()
+
+# builds a regular expression matching any of the keywords, as a trie so
+# keywords sharing a start are only tried once per position in the name.
+# A keyword that starts another one is enough on its own, so the longer
+# one is dropped
+def getKeywordPattern(keywords, case_sensitive):
+    trie = dict()
+    for word in keywords:
+        if not case_sensitive:
+            word = word.lower()
+        node = trie
+        for character in word:
+            node = node.setdefault(character, dict())
+        node[''] = True
+    return getTriePattern(trie)
+
+def getTriePattern(node):
+    import re
+    if '' in node:
+        return ''
+    branches = [re.escape(character) + getTriePattern(child) for (character, child) in sorted(node.items())]
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+# the regular expression for the columns of a transmission-remote -l
+# line. It puts at least two spaces between columns, the values of all
+# but the name (which comes last) are words with one space between them,
+# and a * after the id marks a torrent with an error
+def getListPattern():
+    import re
+    return re.compile(r" *(\d+)\*? +(\S+) +(\S+(?: \S+)?)  +(\S+(?: \S+)?)  +(\S+) +(\S+) +(\S+)  +(\S+(?: \S+)*)  +(.*\S)")
+
+# a Torrent from the values of Torrent.getSaved, without extra data or history
+def loadTorrent(values):
+    torrent = Torrent.__new__(Torrent)
+    for (name, value) in zip(Torrent.saved_fields, values):
+        setattr(torrent, name, value)
+    torrent.has_extra_data = torrent.stale = False
+    torrent.endpoint = torrent.history_slot = torrent.history = torrent.details = None
+    return torrent
+
+# splits a line of transmission-remote -l on double spaces, for
+# lines the regular expression doesn't match
+def splitLine(line):
+    values = list()
+    for p in line.split("  "):
+        p = p.strip()
+        if p != '':
+            values.append(p)
+    return values
+
+# converts bytes per second from the rpc interface into the
+# KiB/s string transmission-remote prints
+def getKBps(bytes_per_second):
+    return "%.1f" % (bytes_per_second / 1024.0)
+
+# formats a byte count like transmission-remote does (4.37 GB)
+def getSizeString(size, units=["B", "KB", "MB", "GB", "TB"]):
+    size = float(size)
+    for unit in units[:-1]:
+        if size < 1024:
+            break
+        size = size / 1024
     else:
-        speed = `round(kbps, 2)`
-        unit = k_unit
-    return speed[:(speed.find('.') + 2)] + " " + unit
+        unit = units[-1]
+    if unit == units[0]:
+        return "%d %s" % (size, unit)
+    elif size < 100:
+        return "%.2f %s" % (size, unit)
+    return "%.1f %s" % (size, unit)
+
+# formats a ratio like transmission-remote does
+def getRatioString(ratio):
+    if ratio == -1:
+        return "None"
+    elif ratio == -2:
+        return "Inf"
+    elif ratio < 10:
+        return "%.2f" % ratio
+    elif ratio < 100:
+        return "%.1f" % ratio
+    return "%.0f" % ratio
+
+# what a torrent's speed history is kept under, telling apart torrents
+# that get the same id after another is removed, or on another daemon
+def getHistoryKey(torrent):
+    return "%s\0%s\0%s" % (torrent.endpoint or "", torrent.id, torrent.name)
+
+# draws numbers as a line of block characters, the highest one full height
+def getSparkline(values, blocks=u"\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"):
+    if not values:
+        return u""
+    highest = max(values)
+    if highest <= 0:
+        return blocks[0] * len(values)
+    return u"".join([blocks[int(v / highest * (len(blocks) - 1) + 0.5)] for v in values])
+
+# reads a size transmission-remote printed (310.2 MB) into bytes, None if it isn't one
+def getSizeBytes(size, units={"B": 0, "KB": 1, "MB": 2, "GB": 3, "TB": 4}):
+    try:
+        (number, unit) = size.split()
+        return float(number) * 1024 ** units[unit.upper().replace("IB", "B")]
+    except (AttributeError, ValueError, KeyError):
+        return None
+
+# crc32 of some text, as an unsigned number, for naming cache files
+def getCRC(text):
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    return zlib.crc32(text) & 0xffffffff
+
+# what tells apart the saved outputs of different command lines
+def getRenderKey(argv):
+    return repr(argv[1:])
+
+# how much of an exponentially weighted average is left after elapsed
+# seconds, with the given time constant
+def getDecay(elapsed, smoothing):
+    import math
+    return math.exp(-elapsed / smoothing)
+
+# a datetime from a unix timestamp
+def getDate(timestamp):
+    from datetime import datetime
+    return datetime.fromtimestamp(timestamp)
+
+# a datetime from a date as transmission-remote -i prints it
+def parseDate(value):
+    from datetime import datetime
+    return datetime.strptime(value, "%a %b %d %H:%M:%S %Y")
+
+# seconds to wait after the given number of failures in a row
+def getBackoff(failures, start, maximum):
+    return min(start * 2 ** (failures - 1), maximum)
+
+# fills in how many seconds old output is
+def setStaleSecs(output, seconds):
+    return output.replace("[:STALE_SECS:]", str(int(max(0, seconds))))
+
+# sort key helpers for mixing directions in one --sortby spec
+def getNegated(getter, torrent):
+    return -getter(torrent)
+
+def getDescending(getter, torrent):
+    return Descending(getter(torrent))
+
+# reads a number transmission-remote printed, 0 if it isn't one
+def getNumber(str):
+    try:
+        return float(str)
+    except (TypeError, ValueError):
+        return 0.0
+
+# the number behind a ratio string, so "None" (nothing downloaded yet)
+# sorts below every ratio and "Inf" above
+def getRatioValue(ratio):
+    if ratio == "None":
+        return -1.0
+    elif ratio == "Inf":
+        return float("inf")
+    return getNumber(ratio)
+
+# formats an eta in seconds like transmission-remote -l does
+def getETAString(eta):
+    if eta < 0:
+        return "Unknown"
+    elif eta < 60:
+        return "%d secs" % eta
+    elif eta < 3600:
+        return "%d min" % (eta / 60)
+    elif eta < 86400:
+        return "%d hrs" % (eta / 3600)
+    return "%d days" % (eta / 86400)
+
+# the seconds in an eta as transmission-remote -l prints it, a very
+# large number for Unknown so those sort last
+# (use eta_cache rather than calling it for every torrent)
+def getETASeconds(eta):
+    if eta.find("secs") > 0:
+        return int(eta.strip(' secs'))
+    elif eta.find("min") > 0:
+        return 60 * int(eta.strip(' mins'))
+    elif eta.find("hrs")  > 0:
+        return 3600 * int(eta.strip(' hrs'))
+    elif eta.find("days")  > 0:
+        return 86400 * int(eta.strip(' days'))
+    elif eta == "Done":
+        return 0
+    return 9999999999999999
+
+# reads and compiles a template file, False if it can't be read
+def getTemplate(path):
+    text = getFile(path)
+    if text:
+        return Template(text)
+    return False
 
 def getFile(path):
+    import codecs
     path = path.replace("//","/")
     try:
         fileinput = codecs.open(os.path.expanduser(path),encoding='utf-8')
         filedata = fileinput.read()
         fileinput.close()
-    except Exception, e:
+    except Exception as e:
         return False
     else:
         return filedata
+
+# replaces the file at path with data in one step, so readers
+# never see a half written file
+def writeFile(path, data):
+    import codecs
+    path = os.path.expanduser(path.replace("//","/"))
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    fileoutput = codecs.open(tmp_path, "w", encoding='utf-8')
+    fileoutput.write(data)
+    fileoutput.close()
+    os.rename(tmp_path, path)
         
-def getCommandOutput(command_list):
-    p = Popen(command_list, stdout=PIPE, stderr=PIPE)
-    output = p.communicate()[0]
-    return output.splitlines()
+# calls render under cProfile, writing the report to path
+# returns what render did
+def renderProfiled(render, path):
+    import cProfile
+    import pstats
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    profile = cProfile.Profile()
+    output = profile.runcall(render)
+    path = os.path.expanduser(path)
+    if path.endswith(".prof"):
+        profile.dump_stats(path)
+    else:
+        report = StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(40)
+        writeFile(path, report.getvalue())
+    return output
 
-if __name__ == "__main__":
-    (options, args) = CommandLineParser().parse_args()
+# reads from a pipe until it is closed, giving up (returning None) at deadline
+def readPipe(fd, deadline):
+    import select
+    chunks = list()
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+# runs a command, yielding the lines it prints as text, a list for each
+# read of its output, as they come instead of once it has finished. With a
+# StageTimer, the time spent waiting for it is added to its fetch stage
+def readCommand(command_list, timer=None):
+    started = time.time()
+    import codecs
+    from subprocess import Popen, PIPE
+    #not installed (or not on PATH) fails like the daemon being down
+    try:
+        p = Popen(command_list, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        raise CommandError("%s failed: %s" % (command_list[0], e.strerror or e))
+    elapsed = time.time() - started
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    fd = p.stdout.fileno()
+    pending = u""
+    printed = False
+    try:
+        while True:
+            started = time.time()
+            chunk = os.read(fd, 65536)
+            elapsed = elapsed + time.time() - started
+            if not chunk:
+                break
+            printed = True
+            text = pending + decoder.decode(chunk)
+            if u"\r" in text:
+                text = text.replace(u"\r\n", u"\n")
+            lines = text.split(u"\n")
+            #the last line may not be all there yet
+            pending = lines.pop()
+            if lines:
+                yield lines
+        pending = pending + decoder.decode(b"", True)
+        if pending:
+            yield [pending]
+    finally:
+        #stopped early, the command gets a broken pipe if it isn't done
+        started = time.time()
+        p.stdout.close()
+        errors = p.stderr.read()
+        p.stderr.close()
+        p.wait()
+        if timer is not None:
+            timer.addElapsed("fetch", elapsed + time.time() - started)
+    if p.returncode != 0 and not printed:
+        errors = errors.decode("utf-8", "replace").strip()
+        raise CommandError("%s failed: %s" % (command_list[0], errors or p.returncode))
+
+# prints text for conky, as utf-8 whatever the locale
+def writeOutput(output):
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    out.write(output.encode("utf-8") + b"\n")
+    out.flush()
+
+# the fast path: the output an earlier run saved, if it will do (younger than
+# --maxage, or a --timeout-ms refresh is already going or backing off), found
+# without importing or building any of the rest. None if a refresh is needed.
+# Only the few options it needs are read, anything unusual is left to the
+# full parser
+def getSavedOutput(argv):
+    values = {"cache_dir": CommandLineParser.default_cache_dir}
+    names = {"-c": "cache_dir", "--cachedir": "cache_dir", "--maxage": "max_age", "--timeout-ms": "timeout_ms"}
+    args = argv[1:]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ("-d", "--daemon", "-h", "--help", "-v", "-V", "--version"):
+            return None
+        (name, equals, value) = arg.partition("=")
+        if name in names and name.startswith("--") and equals:
+            values[names[name]] = value
+        elif arg in names and i + 1 < len(args):
+            values[names[arg]] = args[i + 1]
+            i = i + 1
+        elif arg.startswith("-c") and not arg.startswith("--"):
+            values["cache_dir"] = arg[2:]
+        i = i + 1
+    try:
+        max_age = float(values.get("max_age", 0))
+        timeout_ms = int(values.get("timeout_ms", 0))
+    except ValueError:
+        return None
+    if not values["cache_dir"] or (max_age <= 0 and timeout_ms <= 0):
+        return None
+    cache = RenderCache(values["cache_dir"], getRenderKey(argv))
+    if cache.time is None:
+        return None
+    if max_age > 0 and time.time() - cache.time < max_age:
+        return cache.getOutput()
+    if timeout_ms > 0 and (cache.isBackingOff() or cache.isLocked()):
+        return cache.getOutput()
+    return None
+
+# conversions that come up again for torrent after torrent, and refresh
+# after refresh with --daemon, shared by every Torrent and TemplateWriter
+speed_cache = ConversionCache(getSpeed)
+eta_cache = ConversionCache(getETASeconds)
+date_cache = ConversionCache(parseDate)
+timestamp_cache = ConversionCache(getDate)
+conversion_caches = {"speed": speed_cache, "eta": eta_cache, "date": date_cache, "timestamp": timestamp_cache}
+
+def main(argv):
+    output = getSavedOutput(argv)
+    if output is not None:
+        if output:
+            writeOutput(output)
+        return 0
+    (options, args) = CommandLineParser().parse_args(argv)
     if options.version:
-        print "conkyTransmission v.0.2"
+        print("conkyTransmission v.0.2")
+    elif options.action:
+        return ConkyTransmissionActions(options).run()
+    elif options.daemon:
+        ConkyTransmissionDaemon(options).run()
+    elif options.views:
+        ConkyTransmissionViews(options).run()
     else:    
-        ConkyTransmission(options)
+        ConkyTransmission(options).run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
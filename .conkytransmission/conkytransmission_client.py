@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# conkytransmission_client.py
+# Prints the output of a running "conkytransmission.py --daemon" for conky.
+# Kept deliberately tiny (no conkytransmission import) so conky can run it
+# every few seconds for next to nothing.
+#
+# Usage:
+#    ${execpi 3 /path/to/conkytransmission_client.py -s /path/to/socket}
+#    ${execpi 3 /path/to/conkytransmission_client.py -f /path/to/outfile}
+# When both are given the socket is tried first and the file is the fallback,
+# also used when the socket answers with nothing.
+
+import sys
+import socket
+
+def readSocket(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        client.close()
+
+def readFile(path):
+    fileinput = open(path, "rb")
+    try:
+        return fileinput.read()
+    finally:
+        fileinput.close()
+
+def main(argv):
+    sources = []
+    i = 1
+    while i < len(argv) - 1:
+        if argv[i] in ("-s", "--socket"):
+            sources.append((readSocket, argv[i+1]))
+        elif argv[i] in ("-f", "--file"):
+            sources.append((readFile, argv[i+1]))
+        i = i + 2
+    if not sources:
+        sys.stderr.write("usage: %s [-s SOCKET] [-f FILE]\n" % argv[0])
+        return 2
+    for reader, path in sources:
+        try:
+            output = reader(path)
+        except (IOError, OSError, socket.error):
+            continue
+        #a daemon that hasn't rendered anything yet, try the next one
+        if not output:
+            continue
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        out.write(output + b"\n")
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# bench_parse.py
+# Times parsing synthetic transmission-remote output: -l listings split
+# into columns with the regular expression against the old split on double
+# spaces (on their own, and making torrent records, the old way with
+# LegacyTorrent, a cut down copy of the old Torrent), and -i details with
+# the name lookup against the old chain of find()s.
+#
+#    python benchmarks/bench_parse.py [--torrents N] [--repeat N]
+
+import sys
+import timeit
+from datetime import datetime
+from optparse import OptionParser
+
+import fixtures
+
+ct = fixtures.loadModule()
+
+class LegacyTorrent:
+    """Torrent's line and detail parsing as it used to be"""
+    status = up = down = None
+
+    def __init__(self, properties):
+        properties = properties.split("  ")
+        count = 0
+        for p in properties:
+            p = p.lstrip().rstrip()
+            if p != '':
+                count = count + 1
+                if count == 1:
+                    self.id = int(p.strip("*"))
+                elif count == 2:
+                    self.percent = int(p.strip("%"))
+                elif count == 4:
+                    self.setETA(p)
+                elif count == 5:
+                    self.up = p
+                elif count == 6:
+                    self.down = p
+                elif count == 7:
+                    self.ratio = p
+                elif count == 8:
+                    self.status = p
+                elif count == 9:
+                    self.name = p
+        if self.status == "Up & Down" and float(self.down) < 0.1:
+            self.status = "Seeding"
+        if self.status == "Up & Down" and float(self.up) < 0.1:
+            self.status = "Downloading"
+        if self.status == "Seeding" and float(self.up) < 0.1:
+            self.status = "Idle"
+        elif self.status == "Downloading" and float(self.down) < 0.1:
+            self.status = "Idle"
+
+    def setETA(self, eta):
+        self.eta = eta
+        if eta.find("secs") > 0:
+            self.eta_seconds = int(eta.strip(' secs'))
+        elif eta.find("min") > 0:
+            self.eta_seconds = 60 * int(eta.strip(' mins'))
+        elif eta.find("hrs")  > 0:
+            self.eta_seconds = 3600 * int(eta.strip(' hrs'))
+        elif eta.find("days")  > 0:
+            self.eta_seconds = 86400 * int(eta.strip(' days'))
+        elif eta == "Done":
+            self.eta_seconds = 0
+        else:
+            self.eta_seconds = 9999999999999999
+
+    # the old setters each searched the line in turn, skipping the ones already set
+    def setExtraData(self, data):
+        found = dict()
+        prefixes = ["Location:", "Availability:", "Total size:", "Downloaded:", "Uploaded:", "Ratio Limit:",
+                    "Corrupt DL:", "Peers:", "Date added:", "Date started:", "Latest activity:",
+                    "Public torrent:", "Piece Count:", "Piece Size:"]
+        for l in data:
+            for prefix in prefixes:
+                if prefix in found:
+                    continue
+                if l.find(prefix) >= 0:
+                    value = l.replace(prefix, "").strip()
+                    if prefix.startswith("Date") or prefix.startswith("Latest"):
+                        value = datetime.strptime(value, "%a %b %d %H:%M:%S %Y")
+                    found[prefix] = value
+                    break
+
+def legacyListing(lines):
+    return [LegacyTorrent(l) for l in lines[1:-1]]
+
+def parsedListing(backend, lines):
+    return [t for torrents in backend.parseTorrents([lines]) for t in torrents]
+
+def legacyDetails(torrents, blocks):
+    for t in torrents:
+        LegacyTorrent("").setExtraData(blocks[t["id"]])
+
+def parsedDetails(torrents, blocks):
+    for t in torrents:
+        ct.Torrent([str(t["id"])]).setExtraData({t["id"]: blocks[t["id"]]})
+
+def best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--torrents", dest="torrents", default=10000, type="int", help="listing size [default: %default]")
+    parser.add_option("--repeat", dest="repeat", default=10, type="int", help="best of how many runs [default: %default]")
+    (options, args) = parser.parse_args()
+    torrents = fixtures.makeTorrents(options.torrents)
+    lines = fixtures.listing(torrents)
+    backend = ct.RemoteBackend(fixtures.makeConfig())
+    blocks = dict()
+    for t in torrents[:1000]:
+        blocks[t["id"]] = fixtures.details([t])
+    for old, new in zip(legacyListing(lines), parsedListing(backend, lines)):
+        if (old.id, old.percent, old.up, old.down, old.ratio, old.name) != (new.id, new.percent, new.up, new.down, new.ratio, new.name):
+            raise SystemExit("parsers disagree on torrent %d" % old.id)
+    print("%-32s  %10s  %10s  %7s" % ("", "legacy ms", "new ms", "speedup"))
+    match = ct.getListPattern().match
+    legacy = best(lambda: [ct.splitLine(l) for l in lines[1:-1]], options.repeat)
+    new = best(lambda: [match(l).groups() for l in lines[1:-1]], options.repeat)
+    print("%-32s  %10.1f  %10.1f  %6.1fx" % ("-l columns, %d lines" % (len(lines) - 2), legacy, new, legacy / new))
+    legacy = best(lambda: legacyListing(lines), options.repeat)
+    new = best(lambda: parsedListing(backend, lines), options.repeat)
+    print("%-32s  %10.1f  %10.1f  %6.1fx" % ("-l listing, %d lines" % (len(lines) - 2), legacy, new, legacy / new))
+    #LegacyTorrent only has the listing's fields, the old Torrent had more
+    old = legacyListing(lines[:3])[0]
+    new = parsedListing(backend, lines[:3])[0]
+    legacy = sys.getsizeof(old) + sys.getsizeof(old.__dict__)
+    new = sys.getsizeof(new)
+    print("%-32s  %10d  %10d  %6.1fx" % ("bytes per record, LegacyTorrent", legacy, new, float(legacy) / new))
+    legacy = best(lambda: legacyDetails(torrents[:1000], blocks), options.repeat)
+    new = best(lambda: parsedDetails(torrents[:1000], blocks), options.repeat)
+    print("%-32s  %10.1f  %10.1f  %6.1fx" % ("-i details, 1000 torrents", legacy, new, legacy / new))
+
+if __name__ == "__main__":
+    main()
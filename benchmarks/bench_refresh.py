@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# bench_refresh.py
+# Times whole conkytransmission runs, the way conky starts them, against
+# synthetic torrents: a fake transmission-remote (fakeremote.py) or the stub
+# rpc server (stubrpc.py). For each size it reports the median wall time of
+# a run, its peak memory and the median time of each stage (from --timings),
+# and can save the results as a baseline or compare them with one.
+#
+#    python benchmarks/bench_refresh.py [--sizes 10,100,1000,10000,50000]
+#        [--backend remote|rpc] [--extradata] [--runs N]
+#        [--save FILE] [--baseline FILE] [--tolerance 0.15]
+#
+# Exits with 1 when --baseline is given and anything got slower or bigger
+# by more than --tolerance. Baselines are only comparable on the machine
+# (and python) that made them; benchmarks/baseline.json is there to be
+# replaced with --save before changing anything.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+from subprocess import Popen, PIPE
+from optparse import OptionParser
+
+import fixtures
+import fakeremote
+
+SCRIPT = os.path.join(fixtures.MODULE_PATH, "conkytransmission.py")
+STAGES = ["fetch", "parse", "history", "filter", "sort", "enrich", "render", "output"]
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+# the folder with the fake transmission-remote for count torrents, made
+# the first time it's needed and kept for later runs
+def getFixtures(folder, count, seed):
+    path = os.path.join(folder, "remote-%d-%d" % (count, seed))
+    if not os.path.exists(os.path.join(path, "transmission-remote")):
+        fakeremote.writeFixtures(path, count, seed)
+    return path
+
+# runs conkytransmission once, returning (wall seconds, peak rss in KiB)
+def runOnce(args, env):
+    import time
+    started = time.time()
+    p = Popen([sys.executable, SCRIPT] + args, stdout=PIPE, stderr=PIPE, env=env)
+    output = p.stdout.read()
+    p.stderr.read()
+    (pid, status, usage) = os.wait4(p.pid, 0)
+    elapsed = time.time() - started
+    p.returncode = status
+    if status != 0 or not output:
+        raise SystemExit("conkytransmission failed (status %d) with %s" % (status, " ".join(args)))
+    return (elapsed, usage.ru_maxrss)
+
+# runs conkytransmission options.runs times for count torrents
+# returns a dict of the median wall time, peak rss and stage times
+def measure(options, count, work):
+    env = dict(os.environ)
+    args = ["-c", os.path.join(work, "cache"), "-n", str(options.number)]
+    if options.extradata:
+        args.append("-e")
+    server = None
+    if options.backend == "rpc":
+        import stubrpc
+        server = stubrpc.StubRPCServer(("localhost", 0), fixtures.makeTorrents(count, options.seed))
+        server.start()
+        args = args + ["-b", "rpc", "--rpcurl", server.getURL()]
+    else:
+        env["PATH"] = getFixtures(options.fixtures, count, options.seed) + os.pathsep + env.get("PATH", "")
+    timings = os.path.join(work, "timings-%d.log" % count)
+    args = args + ["--timings", timings]
+    try:
+        #the first run fills the template cache, like conky's first tick
+        runOnce(args, env)
+        if os.path.exists(timings):
+            os.remove(timings)
+        runs = [runOnce(args, env) for i in range(options.runs)]
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    stages = dict([(stage, list()) for stage in STAGES])
+    for line in open(timings):
+        record = json.loads(line)
+        for stage in STAGES:
+            stages[stage].append(record["stages_ms"].get(stage, 0.0))
+    return {"wall_ms": round(median([r[0] for r in runs]) * 1000, 2),
+            "peak_rss_kb": max([r[1] for r in runs]),
+            "stages_ms": dict([(stage, round(median(stages[stage]), 3)) for stage in STAGES])}
+
+# prints the results, against the baseline if there is one
+# returns the names of anything that regressed
+def report(results, baseline, tolerance):
+    regressions = list()
+    print("%-14s  %10s  %9s  %10s  %s" % ("run", "wall ms", "peak MiB", "vs base", "stages ms (" + " ".join(STAGES) + ")"))
+    for key in sorted(results.keys(), key=lambda k: (k.split("/")[0], int(k.split("/")[1]))):
+        result = results[key]
+        compared = ""
+        old = baseline.get(key)
+        if old:
+            change = result["wall_ms"] / old["wall_ms"] - 1
+            compared = "%+.0f%%" % (change * 100)
+            if change > tolerance:
+                regressions.append("%s wall time %+.0f%%" % (key, change * 100))
+            growth = float(result["peak_rss_kb"]) / old["peak_rss_kb"] - 1
+            if growth > tolerance:
+                regressions.append("%s peak memory %+.0f%%" % (key, growth * 100))
+        stages = " ".join(["%.1f" % result["stages_ms"][stage] for stage in STAGES])
+        print("%-14s  %10.1f  %9.1f  %10s  %s" % (key, result["wall_ms"], result["peak_rss_kb"] / 1024.0, compared, stages))
+    return regressions
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sizes", dest="sizes", default="10,100,1000,10000,50000", help="torrent counts to run with [default: %default]")
+    parser.add_option("--backend", dest="backend", default="remote", type="choice", choices=["remote", "rpc"], help="fake transmission-remote or stub rpc server [default: %default]")
+    parser.add_option("--extradata", dest="extradata", default=False, action="store_true", help="run with -e")
+    parser.add_option("--number", dest="number", default=99, type="int", help="-n to run with [default: %default]")
+    parser.add_option("--runs", dest="runs", default=5, type="int", help="runs to take the median of [default: %default]")
+    parser.add_option("--seed", dest="seed", default=0, type="int", help="random seed for the synthetic torrents [default: %default]")
+    parser.add_option("--fixtures", dest="fixtures", default=os.path.join(tempfile.gettempdir(), "conkytransmission-bench"), help="where to keep the generated fixtures [default: %default]")
+    parser.add_option("--save", dest="save", metavar="FILE", help="save the results as a baseline")
+    parser.add_option("--baseline", dest="baseline", metavar="FILE", help="compare with a saved baseline")
+    parser.add_option("--tolerance", dest="tolerance", default=0.15, type="float", help="how much slower or bigger counts as a regression [default: %default]")
+    (options, args) = parser.parse_args()
+    baseline = dict()
+    if options.baseline:
+        baseline = json.load(open(options.baseline))["results"]
+    work = tempfile.mkdtemp(prefix="conkytransmission-bench-")
+    results = dict()
+    try:
+        for count in [int(size) for size in options.sizes.split(",")]:
+            key = "%s/%d" % (options.backend + ("-e" if options.extradata else ""), count)
+            results[key] = measure(options, count, work)
+    finally:
+        shutil.rmtree(work)
+    regressions = report(results, baseline, options.tolerance)
+    if options.save:
+        saved = dict()
+        if os.path.exists(options.save):
+            saved = json.load(open(options.save))["results"]
+        saved.update(results)
+        output = open(options.save, "w")
+        json.dump({"python": sys.version.split()[0], "results": saved}, output, indent=1, sort_keys=True)
+        output.write("\n")
+        output.close()
+    if regressions:
+        print("\nregressions against %s:" % options.baseline)
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# bench_sort.py
+# Compares picking the top --number torrents with the old full sort (a key
+# that eval()s the attribute, string speeds and ratios) against the
+# precomputed sort key and streaming heap selection in
+# ConkyTransmission.sortTorrents.
+#
+#    python benchmarks/bench_sort.py [--number N] [--repeat N]
+
+import timeit
+from operator import attrgetter
+from optparse import OptionParser
+
+import fixtures
+
+ct = fixtures.loadModule()
+
+# what ConkyTransmission.sortTorrents and selectTorrents did before
+def legacyTop(torrents, sort_by, number):
+    if sort_by == "progress":
+        torrents = sorted(torrents, key=attrgetter("percent", "ratio"), reverse=True)
+    else:
+        field = {"eta": "eta_seconds"}.get(sort_by, sort_by)
+        sortover = "torrent." + field
+        torrents = sorted(torrents, key=lambda torrent: eval(sortover))
+    return torrents[:number]
+
+def currentTop(conky, torrents):
+    return conky.sortTorrents(iter(torrents))
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--number", dest="number", default=10, type="int", help="how many torrents to keep [default: %default]")
+    parser.add_option("--repeat", dest="repeat", default=5, type="int", help="best of how many runs [default: %default]")
+    (options, args) = parser.parse_args()
+    print("%-18s  %8s  %12s  %12s  %7s" % ("sortby", "torrents", "legacy ms", "current ms", "speedup"))
+    for sort_by in ("progress", "eta", "status,eta,-ratio"):
+        conky = ct.ConkyTransmission(fixtures.makeConfig(["-s", sort_by, "-n", str(options.number)]))
+        for count in (100, 1000, 10000):
+            torrents = [ct.Torrent(t) for t in fixtures.makeTorrents(count)]
+            number = max(1, 20000 // count)
+            current = min(timeit.repeat(lambda: currentTop(conky, torrents), number=number, repeat=options.repeat)) / number
+            if "," in sort_by:
+                #the old code couldn't sort on several keys at all
+                print("%-18s  %8d  %12s  %12.3f  %7s" % (sort_by, count, "-", current * 1000, "-"))
+                continue
+            legacy = min(timeit.repeat(lambda: legacyTop(torrents, sort_by, options.number), number=number, repeat=options.repeat)) / number
+            print("%-18s  %8d  %12.3f  %12.3f  %6.1fx" % (sort_by, count, legacy * 1000, current * 1000, legacy / current))
+
+if __name__ == "__main__":
+    main()
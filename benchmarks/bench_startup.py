@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# bench_startup.py
+# Times how long conky waits for one tick, start to finish, for each way of
+# starting conkytransmission: conkytransmission.py under python 2, and
+# conkytransmission_fast.py under python 3 with and without -S. Each is
+# timed
+#    cold  - nothing cached: no bytecode and an empty --cachedir
+#    warm  - bytecode and parsed templates cached, a full refresh
+#    saved - a run within --maxage of the last one, printing its output
+# against the fake transmission-remote from fakeremote.py.
+#
+#    python benchmarks/bench_startup.py [--torrents 100] [--runs 10]
+#        [--python2 python2] [--python3 python3]
+#
+# An interpreter that isn't installed has its rows skipped.
+# PYTHONDONTWRITEBYTECODE is left out of the runs' environment, otherwise
+# warm starts would compile the script every time just like cold ones.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from subprocess import Popen, PIPE
+from optparse import OptionParser
+
+import fixtures
+import bench_refresh
+
+SCRIPTS = {"py2": "conkytransmission.py", "py3": "conkytransmission_fast.py"}
+KINDS = ["cold", "warm", "saved"]
+
+def clearBytecode():
+    for name in os.listdir(fixtures.MODULE_PATH):
+        if name.endswith(".pyc"):
+            os.remove(os.path.join(fixtures.MODULE_PATH, name))
+    shutil.rmtree(os.path.join(fixtures.MODULE_PATH, "__pycache__"), ignore_errors=True)
+
+# the path of program, or None if it isn't installed
+def findProgram(program):
+    try:
+        from shutil import which
+    except ImportError:
+        #python 2
+        from distutils.spawn import find_executable as which
+    return which(program)
+
+# runs one tick, returning how long it took in seconds
+def runOnce(command, env):
+    started = time.time()
+    p = Popen(command, stdout=PIPE, stderr=PIPE, env=env)
+    (output, errors) = p.communicate()
+    elapsed = time.time() - started
+    if p.returncode != 0 or not output:
+        raise SystemExit("%s failed (status %d): %s" % (" ".join(command), p.returncode, errors.decode("utf-8", "replace").strip()))
+    return elapsed
+
+# the median time of options.runs ticks of each kind for one way of starting
+def measure(options, command, env, work):
+    cache = os.path.join(work, "cache")
+    results = dict()
+    times = list()
+    for i in range(options.runs):
+        clearBytecode()
+        shutil.rmtree(cache, ignore_errors=True)
+        times.append(runOnce(command + ["-c", cache], env))
+    results["cold"] = bench_refresh.median(times)
+    times = [runOnce(command + ["-c", cache], env) for i in range(options.runs)]
+    results["warm"] = bench_refresh.median(times)
+    #a long --maxage, so every run after the first is within it
+    saved = command + ["-c", cache, "--maxage", "3600"]
+    runOnce(saved, env)
+    times = [runOnce(saved, env) for i in range(options.runs)]
+    results["saved"] = bench_refresh.median(times)
+    return results
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--torrents", dest="torrents", default=100, type="int", help="how many synthetic torrents [default: %default]")
+    parser.add_option("--runs", dest="runs", default=10, type="int", help="runs to take the median of [default: %default]")
+    parser.add_option("--python2", dest="python2", default="python2", help="python 2 to run conkytransmission.py with, empty to skip [default: %default]")
+    parser.add_option("--python3", dest="python3", default="python3", help="python 3 to run conkytransmission_fast.py with, empty to skip [default: %default]")
+    parser.add_option("--seed", dest="seed", default=0, type="int", help="random seed for the synthetic torrents [default: %default]")
+    parser.add_option("--fixtures", dest="fixtures", default=os.path.join(tempfile.gettempdir(), "conkytransmission-bench"), help="where to keep the generated fixtures [default: %default]")
+    (options, args) = parser.parse_args()
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PATH"] = bench_refresh.getFixtures(options.fixtures, options.torrents, options.seed) + os.pathsep + env.get("PATH", "")
+    starts = list()
+    if options.python2:
+        starts.append(("py2", [options.python2, os.path.join(fixtures.MODULE_PATH, SCRIPTS["py2"])]))
+    if options.python3:
+        script = os.path.join(fixtures.MODULE_PATH, SCRIPTS["py3"])
+        starts.append(("py3", [options.python3, script]))
+        starts.append(("py3 -S", [options.python3, "-S", script]))
+    work = tempfile.mkdtemp(prefix="conkytransmission-bench-")
+    print("%-8s  %10s  %10s  %10s" % tuple(["start"] + [kind + " ms" for kind in KINDS]))
+    try:
+        for (name, command) in starts:
+            if not findProgram(command[0]):
+                print("%-8s  skipped, %s isn't installed" % (name, command[0]))
+                continue
+            results = measure(options, command, env, work)
+            print("%-8s  %10.1f  %10.1f  %10.1f" % tuple([name] + [results[kind] * 1000 for kind in KINDS]))
+    finally:
+        shutil.rmtree(work)
+        clearBytecode()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# bench_templates.py
+# Compares rendering torrents with the compiled Template against the old
+# approach of one str.replace pass per torrent attribute.
+#
+#    python benchmarks/bench_templates.py [--repeat N]
+
+import timeit
+from optparse import OptionParser
+
+import fixtures
+
+ct = fixtures.loadModule()
+
+# the renderer TemplateWriter.getTorrentOutput used before templates were compiled
+def legacyTorrentOutput(writer, torrents):
+    output = ""
+    for torrent in torrents:
+        template = writer.getTorrentTemplate(torrent.status).text
+        name = torrent.name[:writer.config.name_length]
+        for p in type(torrent).__slots__:
+            v = getattr(torrent, p, None)
+            if v is None:
+                continue
+            if p == "name":
+                v = name
+            template = template.replace("[:"+p.upper()+":]", str(v))
+        template = template.replace("[:UP_KBPS:]", str(writer.getSpeed(torrent.up)))
+        template = template.replace("[:DOWN_KBPS:]", str(writer.getSpeed(torrent.down)))
+        output += template
+    return output
+
+def compiledTorrentOutput(writer, torrents):
+    writer.reset()
+    writer.getTorrentOutput(torrents)
+    return writer.torrent_output
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--repeat", dest="repeat", default=5, type="int", help="best of how many runs [default: %default]")
+    (options, args) = parser.parse_args()
+    config = fixtures.makeConfig()
+    writer = ct.TemplateWriter(config)
+    print("%8s  %12s  %12s  %7s" % ("torrents", "legacy ms", "compiled ms", "speedup"))
+    for count in (10, 100, 1000):
+        torrents = [ct.Torrent(t) for t in fixtures.makeTorrents(count)]
+        if legacyTorrentOutput(writer, torrents) != compiledTorrentOutput(writer, torrents):
+            raise SystemExit("outputs differ for %d torrents" % count)
+        number = max(1, 2000 // count)
+        legacy = min(timeit.repeat(lambda: legacyTorrentOutput(writer, torrents), number=number, repeat=options.repeat)) / number
+        compiled = min(timeit.repeat(lambda: compiledTorrentOutput(writer, torrents), number=number, repeat=options.repeat)) / number
+        print("%8d  %12.3f  %12.3f  %6.1fx" % (count, legacy * 1000, compiled * 1000, legacy / compiled))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# fakeremote.py
+# A stand-in for transmission-remote printing synthetic torrents from
+# fixtures.py, for running conkytransmission end to end without transmission.
+#
+#    python benchmarks/fakeremote.py --write DIR --torrents 1000
+#    PATH=DIR:$PATH .conkytransmission/conkytransmission.py
+#
+# --write saves the -l listing and the -i details of the torrents in DIR,
+# along with a transmission-remote script that prints them: the listing
+# with cat, like the real one it costs one process start, and the details
+# by running this file, which looks the asked for torrents up in an index.
+
+import os
+import sys
+import marshal
+from optparse import OptionParser
+
+import fixtures
+
+# the transmission-remote options of conkytransmission's --action
+ACTIONS = ["--start", "--stop", "--verify", "--reannounce", "--remove", "--remove-and-delete", "--move"]
+
+# writes the fixture files and the transmission-remote script to folder
+def writeFixtures(folder, count, seed):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    torrents = fixtures.makeTorrents(count, seed)
+    writeLines(os.path.join(folder, "list.txt"), fixtures.listing(torrents))
+    index = dict()
+    details = open(os.path.join(folder, "details.txt"), "wb")
+    try:
+        for t in torrents:
+            text = ("\n".join(fixtures.details([t])) + "\n").encode("utf-8")
+            index[t["id"]] = (details.tell(), len(text))
+            details.write(text)
+    finally:
+        details.close()
+    output = open(os.path.join(folder, "details.index"), "wb")
+    try:
+        marshal.dump(index, output)
+    finally:
+        output.close()
+    script = os.path.join(folder, "transmission-remote")
+    output = open(script, "w")
+    try:
+        output.write("#!/bin/sh\n"
+                     "if [ \"$1\" = \"-l\" ]; then exec cat '%s'; fi\n"
+                     "exec '%s' '%s' --read '%s' \"$@\"\n" %
+                     (os.path.join(folder, "list.txt"), sys.executable, os.path.abspath(__file__), folder))
+    finally:
+        output.close()
+    os.chmod(script, 0o755)
+
+def writeLines(path, lines):
+    output = open(path, "wb")
+    try:
+        output.write(("\n".join(lines) + "\n").encode("utf-8"))
+    finally:
+        output.close()
+
+# prints the details of the torrents in ids ("1,2,3" or "all")
+def printDetails(folder, ids):
+    fileinput = open(os.path.join(folder, "details.index"), "rb")
+    try:
+        index = marshal.load(fileinput)
+    finally:
+        fileinput.close()
+    if ids == "all":
+        wanted = sorted(index.keys())
+    else:
+        wanted = [int(i) for i in ids.split(",") if i]
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    details = open(os.path.join(folder, "details.txt"), "rb")
+    try:
+        for torrent_id in wanted:
+            if torrent_id in index:
+                (offset, length) = index[torrent_id]
+                details.seek(offset)
+                out.write(details.read(length))
+    finally:
+        details.close()
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == "--read":
+        #called by the transmission-remote script: --read DIR -t IDS -i
+        args = argv[3:]
+        if len(args) >= 3 and args[0] == "-t" and args[2] == "-i":
+            printDetails(argv[2], args[1])
+            return 0
+        if len(args) >= 3 and args[0] == "-t" and args[2] in ACTIONS:
+            #the listing is fixed, so actions change nothing, they just
+            #succeed, each added to actions.txt as its arguments
+            output = open(os.path.join(argv[2], "actions.txt"), "a")
+            try:
+                output.write(" ".join(args) + "\n")
+            finally:
+                output.close()
+            print('localhost:9091/transmission/rpc/ responded: "success"')
+            return 0
+        sys.stderr.write("fakeremote: unsupported arguments %s\n" % " ".join(args))
+        return 1
+    parser = OptionParser()
+    parser.add_option("--write", dest="folder", metavar="DIR", help="folder to write the fixtures and transmission-remote script to")
+    parser.add_option("--torrents", dest="torrents", default=100, type="int", help="how many synthetic torrents [default: %default]")
+    parser.add_option("--seed", dest="seed", default=0, type="int", help="random seed for the synthetic torrents [default: %default]")
+    (options, args) = parser.parse_args(argv[1:])
+    if not options.folder:
+        parser.error("--write DIR is needed")
+    writeFixtures(options.folder, options.torrents, options.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
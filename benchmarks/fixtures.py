@@ -0,0 +1,183 @@
+# fixtures.py
+# Synthetic torrent data for exercising conkytransmission without a real
+# transmission daemon. Torrents are plain dicts shaped like the ones the
+# rpc method torrent-get returns, generated from a fixed seed so every run
+# sees the same data.
+
+import os
+import sys
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_PATH = os.path.join(ROOT, ".conkytransmission")
+
+GROUPS = ["GROUP", "RARBG", "EVO", "SPARKS", "FLEET", "DIMENSION", "LOL", "KILLERS"]
+WORDS = ["ubuntu", "debian", "fedora", "arch", "linux", "desktop", "server", "live",
+         "amd64", "i386", "dvd", "netinst", "release", "final", "beta", "docs"]
+
+# old (<2.40) rpc status numbers, which transmission-remote and
+# conkytransmission both understand, and the newer number for queued
+STOPPED, CHECK_WAIT, CHECK, DOWNLOAD, SEED = 16, 1, 2, 4, 8
+DOWNLOAD_WAIT = 3
+
+def makeTorrent(torrent_id, rand, now=1282350603):
+    size = rand.randint(1, 8000) * 1024 * 1024
+    status = rand.choice([STOPPED, SEED, SEED, SEED, DOWNLOAD, DOWNLOAD, CHECK_WAIT, CHECK, DOWNLOAD_WAIT])
+    done = status == SEED or (status == STOPPED and rand.random() < 0.5)
+    left = 0 if done else rand.randint(0, size)
+    uploading = rand.randint(0, 5) if status in (SEED, DOWNLOAD) else 0
+    downloading = rand.randint(0, 30) if status == DOWNLOAD else 0
+    rate_up = rand.randint(0, 200 * 1024) if uploading else 0
+    rate_down = rand.randint(0, 2000 * 1024) if downloading else 0
+    if left and rate_down:
+        eta = left // rate_down
+    elif left:
+        eta = -1
+    else:
+        eta = -1
+    uploaded = rand.randint(0, 3 * size)
+    name = "%s.%s.%s-%s" % (rand.choice(WORDS).capitalize(), rand.choice(WORDS),
+                            rand.choice(WORDS), rand.choice(GROUPS))
+    return {
+        "id": torrent_id,
+        "hashString": "%040x" % rand.getrandbits(160),
+        "name": name,
+        "status": status,
+        "isFinished": done and status == STOPPED,
+        "percentDone": float(size - left) / size,
+        "leftUntilDone": left,
+        "sizeWhenDone": size,
+        "desiredAvailable": left,
+        "eta": eta,
+        "rateUpload": rate_up,
+        "rateDownload": rate_down,
+        "uploadRatio": float(uploaded) / size if uploaded else -1,
+        "uploadedEver": uploaded,
+        "downloadedEver": size - left,
+        "corruptEver": rand.choice([0, 0, 0, 16384]),
+        "peersConnected": uploading + downloading + rand.randint(0, 10),
+        "peersGettingFromUs": uploading,
+        "peersSendingToUs": downloading,
+        "downloadDir": "/home/eric/Downloads",
+        "seedRatioMode": rand.choice([0, 1, 2]),
+        "seedRatioLimit": 2.0,
+        "addedDate": now - rand.randint(0, 90 * 86400),
+        "startDate": now - rand.randint(0, 30 * 86400),
+        "activityDate": now - rand.randint(0, 86400),
+        "isPrivate": rand.random() < 0.3,
+        "pieceCount": size // (512 * 1024),
+        "pieceSize": 512 * 1024,
+    }
+
+# returns count synthetic torrents, always the same ones for the same seed
+def makeTorrents(count, seed=0):
+    rand = random.Random(seed)
+    return [makeTorrent(i + 1, rand) for i in range(count)]
+
+# imports conkytransmission.py from the repo, not an installed copy
+def loadModule():
+    if MODULE_PATH not in sys.path:
+        sys.path.insert(0, MODULE_PATH)
+    import conkytransmission
+    return conkytransmission
+
+# returns conkytransmission options as if args were given on the command line
+def makeConfig(args=[]):
+    module = loadModule()
+    parser = module.CommandLineParser()
+    (options, rest) = parser.parser.parse_args(list(args))
+    parser.checkOptions(options, [os.path.join(MODULE_PATH, "conkytransmission.py")] + list(args))
+    return options
+
+# the status transmission-remote shows for a torrent
+def statusString(t):
+    if t["status"] == STOPPED:
+        return "Finished" if t["isFinished"] else "Stopped"
+    elif t["status"] == CHECK_WAIT:
+        return "Will Verify"
+    elif t["status"] == CHECK:
+        return "Verifying"
+    elif t["status"] == DOWNLOAD_WAIT:
+        return "Queued"
+    elif t["peersGettingFromUs"] and t["peersSendingToUs"]:
+        return "Up & Down"
+    elif t["peersSendingToUs"]:
+        return "Downloading"
+    elif t["peersGettingFromUs"]:
+        return "Seeding"
+    return "Idle"
+
+def sizeString(size):
+    return loadModule().getSizeString(size)
+
+def etaString(t):
+    if t["leftUntilDone"] or t["eta"] != -1:
+        return loadModule().getETAString(t["eta"])
+    return "Done"
+
+# the lines transmission-remote -l (2.x) prints for the torrents,
+# header and Sum: line included
+def listing(torrents):
+    ct = loadModule()
+    lines = ["%-4s   %-4s  %9s  %-8s  %6s  %6s  %-5s  %-11s  %s" %
+             ("ID", "Done", "Have", "ETA", "Up", "Down", "Ratio", "Status", "Name")]
+    total_have = total_up = total_down = 0
+    for t in torrents:
+        have = t["sizeWhenDone"] - t["leftUntilDone"]
+        lines.append("%4d%c  %4s  %9s  %-8s  %6.1f  %6.1f  %5s  %-11s  %s" %
+                     (t["id"], " ", "%d%%" % int(t["percentDone"] * 100), sizeString(have), etaString(t),
+                      t["rateUpload"] / 1024.0, t["rateDownload"] / 1024.0,
+                      ct.getRatioString(t["uploadRatio"]), statusString(t), t["name"]))
+        total_have = total_have + have
+        total_up = total_up + t["rateUpload"]
+        total_down = total_down + t["rateDownload"]
+    lines.append("Sum:         %9s             %6.1f  %6.1f" % (sizeString(total_have), total_up / 1024.0, total_down / 1024.0))
+    return lines
+
+def dateString(timestamp):
+    import time
+    return time.strftime("%a %b %d %H:%M:%S %Y", time.localtime(timestamp))
+
+# the lines transmission-remote -t ID -i prints for the torrents
+def details(torrents):
+    ct = loadModule()
+    lines = list()
+    for t in torrents:
+        have = t["sizeWhenDone"] - t["leftUntilDone"]
+        lines.extend([
+            "NAME",
+            "  Id: %d" % t["id"],
+            "  Name: %s" % t["name"],
+            "  Hash: %s" % t["hashString"],
+            "",
+            "TRANSFER",
+            "  State: %s" % statusString(t),
+            "  Location: %s" % t["downloadDir"],
+            "  Percent Done: %d%%" % int(t["percentDone"] * 100),
+            "  ETA: %s" % etaString(t),
+            "  Download Speed: %.1f KiB/s" % (t["rateDownload"] / 1024.0),
+            "  Upload Speed: %.1f KiB/s" % (t["rateUpload"] / 1024.0),
+            "  Have: %s (%s verified)" % (sizeString(have), sizeString(have)),
+            "  Availability: 100%",
+            "  Total size: %s (%s wanted)" % (sizeString(t["sizeWhenDone"]), sizeString(t["sizeWhenDone"])),
+            "  Downloaded: %s" % sizeString(t["downloadedEver"]),
+            "  Uploaded: %s" % sizeString(t["uploadedEver"]),
+            "  Ratio: %s" % ct.getRatioString(t["uploadRatio"]),
+            "  Ratio Limit: %s" % ["Default", "2.00", "Unlimited"][t["seedRatioMode"]],
+            "  Corrupt DL: %s" % (sizeString(t["corruptEver"]) if t["corruptEver"] else "None"),
+            "  Peers: connected to %d, uploading to %d, downloading from %d" %
+            (t["peersConnected"], t["peersGettingFromUs"], t["peersSendingToUs"]),
+            "",
+            "HISTORY",
+            "  Date added:       %s" % dateString(t["addedDate"]),
+            "  Date started:     %s" % dateString(t["startDate"]),
+            "  Latest activity:  %s" % dateString(t["activityDate"]),
+            "",
+            "ORIGINS",
+            "  Date created: %s" % dateString(t["addedDate"]),
+            "  Public torrent: %s" % ("No" if t["isPrivate"] else "Yes"),
+            "  Piece Count: %d" % t["pieceCount"],
+            "  Piece Size: %s" % ct.getSizeString(t["pieceSize"], ["B", "KiB", "MiB", "GiB"]),
+            "",
+        ])
+    return lines
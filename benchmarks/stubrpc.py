@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# stubrpc.py
+# A small stand-in for transmission-daemon's /transmission/rpc endpoint,
+# serving synthetic torrents from fixtures.py. It does the session id
+# handshake and honours "fields" and "ids" the way the real daemon does,
+# and accepts the calls of --action (keeping a list of them in actions).
+#
+# Run it and point conkytransmission at it:
+#    python benchmarks/stubrpc.py --port 9092 --torrents 500
+#    .conkytransmission/conkytransmission.py -b rpc --rpcurl http://localhost:9092/transmission/rpc
+# or start it from python with StubRPCServer(("localhost", 0), torrents).
+
+import sys
+import json
+import time
+import threading
+from optparse import OptionParser
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import fixtures
+
+SESSION_ID = "stub-session-0123456789"
+
+class StubRPCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests = self.server.requests + 1
+        if self.headers.get("X-Transmission-Session-Id") != SESSION_ID:
+            self.reply(409, b"", {"X-Transmission-Session-Id": SESSION_ID})
+            return
+        call = json.loads(body.decode("utf-8"))
+        method = getattr(self.server, "rpc_" + call["method"].replace("-", "_"), None)
+        if method is None:
+            result = {"result": "method name not recognized", "arguments": {}}
+        else:
+            result = {"result": "success", "arguments": method(call.get("arguments", {}))}
+        self.reply(200, json.dumps(result).encode("utf-8"), {"Content-Type": "application/json"})
+
+    def reply(self, status, data, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class StubRPCServer(ThreadingMixIn, HTTPServer):
+    """Serves a fixed list of torrent dicts over transmission's rpc protocol,
+    one thread per (kept alive) connection"""
+    daemon_threads = True
+    # seconds to sit on every torrent-get, to stand in for a busy daemon
+    delay = 0
+
+    def __init__(self, address, torrents, delay=0):
+        HTTPServer.__init__(self, address, StubRPCHandler)
+        self.torrents = torrents
+        self.requests = 0
+        self.delay = delay
+        # (method, arguments) of every call that changed something
+        self.actions = []
+
+    def getURL(self):
+        return "http://%s:%d/transmission/rpc" % self.server_address[:2]
+
+    # serves requests from a background thread
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def selectTorrents(self, ids):
+        if ids is None:
+            return self.torrents
+        if not isinstance(ids, list):
+            ids = [ids]
+        return [t for t in self.torrents if t["id"] in ids or t["hashString"] in ids]
+
+    def rpc_torrent_get(self, arguments):
+        if self.delay:
+            time.sleep(self.delay)
+        fields = arguments.get("fields", [])
+        ids = arguments.get("ids")
+        if ids == "recently-active":
+            #the real daemon means "changed in the last minute", here that is
+            #anything moving data, and nothing is ever removed
+            torrents = [t for t in self.torrents if t["rateUpload"] or t["rateDownload"]]
+            removed = []
+        else:
+            torrents = self.selectTorrents(ids)
+            removed = None
+        result = {"torrents": [dict((f, t[f]) for f in fields if f in t) for t in torrents]}
+        if removed is not None:
+            result["removed"] = removed
+        return result
+
+    # the action methods are only recorded, except that removed torrents go
+    def rpc_torrent_start(self, arguments):
+        return self.recordAction("torrent-start", arguments)
+
+    def rpc_torrent_stop(self, arguments):
+        return self.recordAction("torrent-stop", arguments)
+
+    def rpc_torrent_verify(self, arguments):
+        return self.recordAction("torrent-verify", arguments)
+
+    def rpc_torrent_reannounce(self, arguments):
+        return self.recordAction("torrent-reannounce", arguments)
+
+    def rpc_torrent_set_location(self, arguments):
+        return self.recordAction("torrent-set-location", arguments)
+
+    def rpc_torrent_remove(self, arguments):
+        removed = self.selectTorrents(arguments.get("ids"))
+        self.torrents = [t for t in self.torrents if t not in removed]
+        return self.recordAction("torrent-remove", arguments)
+
+    def recordAction(self, method, arguments):
+        self.actions.append((method, arguments))
+        return {}
+
+    def rpc_session_stats(self, arguments):
+        return {"uploadSpeed": sum(t["rateUpload"] for t in self.torrents),
+                "downloadSpeed": sum(t["rateDownload"] for t in self.torrents),
+                "torrentCount": len(self.torrents)}
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--port", dest="port", default=9092, type="int", help="port to listen on [default: %default]")
+    parser.add_option("--torrents", dest="torrents", default=100, type="int", help="how many synthetic torrents to serve [default: %default]")
+    parser.add_option("--seed", dest="seed", default=0, type="int", help="random seed for the synthetic torrents [default: %default]")
+    parser.add_option("--delay", dest="delay", default=0, type="float", help="seconds to wait before answering torrent-get [default: %default]")
+    (options, args) = parser.parse_args()
+    server = StubRPCServer(("localhost", options.port), fixtures.makeTorrents(options.torrents, options.seed), options.delay)
+    sys.stderr.write("serving %d torrents on %s\n" % (options.torrents, server.getURL()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,141 @@
+# test_actions.py
+# Tests for --action, against the stub rpc daemon and the fake
+# transmission-remote in benchmarks/, which record what they are asked to do.
+#
+#    python -m unittest discover tests
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fixtures
+import fakeremote
+import stubrpc
+
+ct = fixtures.loadModule()
+
+class OutputCatcher:
+    """Keeps what conkytransmission writes to stdout or stderr instead of showing it"""
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+def startServer(torrents):
+    server = stubrpc.StubRPCServer(("localhost", 0), torrents)
+    server.start()
+    return server
+
+# the ids of every torrent an action was sent for, in the order sent
+def getSentIds(server):
+    return [i for (method, arguments) in server.actions for i in arguments["ids"]]
+
+class ActionTest(unittest.TestCase):
+    count = 30
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.servers = [startServer(fixtures.makeTorrents(self.count, seed)) for seed in (1, 2)]
+        self.streams = (sys.stdout, sys.stderr)
+        sys.stdout = OutputCatcher()
+        sys.stderr = OutputCatcher()
+
+    def tearDown(self):
+        (sys.stdout, sys.stderr) = self.streams
+        for server in self.servers:
+            server.delay = 0
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.folder)
+
+    def getArgs(self, servers):
+        args = ["-b", "rpc", "-c", os.path.join(self.folder, "cache"), "--ratelimit", "0"]
+        if len(servers) == 1:
+            return args + ["--rpcurl", servers[0].getURL()]
+        for server in servers:
+            args = args + ["--endpoint", server.getURL()]
+        return args
+
+    def runAction(self, args):
+        return ct.ConkyTransmissionActions(fixtures.makeConfig(args)).run()
+
+    def testDryRun(self):
+        status = self.runAction(self.getArgs(self.servers) + ["--action", "remove-data", "--dryrun"])
+        self.assertEqual(status, 0)
+        self.assertEqual([s.actions for s in self.servers], [[], []])
+        self.assertEqual([len(s.torrents) for s in self.servers], [self.count, self.count])
+        self.assertTrue([l for l in sys.stdout.lines if b"nothing done" in l])
+
+    def testRemoveNeedsSelector(self):
+        for action in ("remove", "remove-data"):
+            self.assertRaises(SystemExit, fixtures.makeConfig, self.getArgs(self.servers[:1]) + ["--action", action])
+            for picked in (["--yes"], ["-n", "3"], ["--status", "Seeding"], ["--minratio", "1"], ["--filterregex", "x"]):
+                fixtures.makeConfig(self.getArgs(self.servers[:1]) + ["--action", action] + picked)
+        #the other actions can't lose anything
+        fixtures.makeConfig(self.getArgs(self.servers[:1]) + ["--action", "stop"])
+
+    def testBatchSize(self):
+        status = self.runAction(self.getArgs(self.servers) + ["--action", "stop", "--batchsize", "4"])
+        self.assertEqual(status, 0)
+        for server in self.servers:
+            self.assertEqual([method for (method, arguments) in server.actions], ["torrent-stop"] * 8)
+            self.assertEqual([len(arguments["ids"]) for (method, arguments) in server.actions], [4] * 7 + [2])
+            self.assertEqual(sorted(getSentIds(server)), sorted(t["id"] for t in server.torrents))
+
+    def testRateLimit(self):
+        server = self.servers[0]
+        times = list()
+        record = server.recordAction
+        def recordAction(method, arguments):
+            times.append(time.time())
+            return record(method, arguments)
+        server.recordAction = recordAction
+        args = self.getArgs([server]) + ["--action", "verify", "-n", "5", "--batchsize", "1", "--ratelimit", "20"]
+        self.assertEqual(self.runAction(args), 0)
+        self.assertEqual(len(times), 5)
+        gaps = [later - earlier for (earlier, later) in zip(times, times[1:])]
+        self.assertTrue(min(gaps) >= 0.045, "requests %s apart" % gaps)
+
+    def testStaleEndpointSkipped(self):
+        (fast, slow) = self.servers
+        args = self.getArgs(self.servers) + ["--endpointtimeout", "0.3"]
+        #an earlier refresh leaves the slow daemon's torrents in --cachedir
+        ct.getBackend(fixtures.makeConfig(args)).getTorrents()
+        slow.delay = 1.5
+        self.assertEqual(self.runAction(args + ["--action", "start"]), 0)
+        self.assertEqual(slow.actions, [])
+        self.assertEqual(sorted(getSentIds(fast)), sorted(t["id"] for t in fast.torrents))
+        self.assertTrue([l for l in sys.stderr.lines if "skipping %d torrents" % self.count in l])
+
+    def testRemoteSendsSameIds(self):
+        server = self.servers[0]
+        remote = os.path.join(self.folder, "remote")
+        fakeremote.writeFixtures(remote, self.count, 1)
+        path = os.environ.get("PATH", "")
+        os.environ["PATH"] = remote + os.pathsep + path
+        try:
+            picked = ["--action", "remove", "--status", "Seeding", "-s", "ratio", "--batchsize", "3", "--ratelimit", "0"]
+            self.assertEqual(self.runAction(["-c", os.path.join(self.folder, "cache")] + picked), 0)
+        finally:
+            os.environ["PATH"] = path
+        self.assertEqual(self.runAction(self.getArgs([server]) + picked), 0)
+        sent = list()
+        for line in open(os.path.join(remote, "actions.txt")):
+            (option, ids, action) = line.split()
+            self.assertEqual((option, action), ("-t", "--remove"))
+            sent.append([int(i) for i in ids.split(",")])
+        self.assertTrue(sent)
+        self.assertEqual(sent, [arguments["ids"] for (method, arguments) in server.actions])
+        self.assertFalse([a for (method, a) in server.actions if a.get("delete-local-data")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# test_conversions.py
+# Tests for how speeds are shown and for ConversionCache, which remembers
+# them and the other per torrent conversions between refreshes.
+#
+#    python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fixtures
+
+ct = fixtures.loadModule()
+
+def getSpeed(kbps):
+    return ct.getSpeed(kbps, "M", "K")
+
+class SpeedTest(unittest.TestCase):
+    def testKilo(self):
+        self.assertEqual(getSpeed("0"), "0.0 K")
+        self.assertEqual(getSpeed("12.5"), "12.5 K")
+        self.assertEqual(getSpeed(1023.99), "1023.9 K")
+
+    def testCutNotRounded(self):
+        self.assertEqual(getSpeed("0.99"), "0.9 K")
+        self.assertEqual(getSpeed(1e-05), "0.0 K")
+        #tenths floats can't hold exactly keep their last digit
+        self.assertEqual(getSpeed(0.3), "0.3 K")
+        self.assertEqual(getSpeed(0.1 + 0.2), "0.3 K")
+        self.assertEqual(getSpeed(-0.7), "-0.7 K")
+
+    def testMega(self):
+        self.assertEqual(getSpeed(1024.0), "1.0 M")
+        self.assertEqual(getSpeed("2047.9"), "1.9 M")
+        self.assertEqual(getSpeed(1024 * 1024), "1024.0 M")
+
+    def testNotANumber(self):
+        for kbps in ("nan", "inf", "-inf", float("nan"), float("inf")):
+            self.assertEqual(getSpeed(kbps), "? K")
+
+    def testUnits(self):
+        self.assertEqual(ct.getSpeed(2048, "MiB/s", "KiB/s"), "2.0 MiB/s")
+        self.assertEqual(ct.getSpeed(3, "MiB/s", "KiB/s"), "3.0 KiB/s")
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.converted = list()
+        self.cache = ct.ConversionCache(self.convert, 4)
+
+    def convert(self, value, unit):
+        self.converted.append(value)
+        return "%s %s" % (value, unit)
+
+    def testHitsAndMisses(self):
+        self.assertEqual(self.cache.get(1, "K"), "1 K")
+        self.assertEqual(self.cache.get(1, "K"), "1 K")
+        self.assertEqual(self.cache.get(1, "M"), "1 M")
+        self.assertEqual(self.converted, [1, 1])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def testEviction(self):
+        for value in (1, 2, 3, 4):
+            self.cache.get(value, "K")
+        #1 and 2 moved to the older half, 3 and 4 are recent, so asking for 1
+        #again is a hit that moves it to a new recent half, dropping 2
+        self.cache.get(1, "K")
+        self.assertEqual(self.converted, [1, 2, 3, 4])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 4))
+        #2 has to be converted again, 1 was kept by asking for it
+        self.cache.get(5, "K")
+        self.cache.get(2, "K")
+        self.cache.get(1, "K")
+        self.assertEqual(self.converted, [1, 2, 3, 4, 5, 2])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 6))
+
+    def testSizeKept(self):
+        for value in range(100):
+            self.cache.get(value, "K")
+        self.assertTrue(len(self.cache.recent) + len(self.cache.older) <= 4)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 100))
+
+    def testSpeedCache(self):
+        cache = ct.ConversionCache(ct.getSpeed)
+        self.assertEqual(cache.get(1024.0, "M", "K"), "1.0 M")
+        self.assertEqual(cache.get(1024.0, "M", "K"), "1.0 M")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+if __name__ == "__main__":
+    unittest.main()
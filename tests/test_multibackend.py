@@ -0,0 +1,184 @@
+# test_multibackend.py
+# Tests for showing several transmission daemons at once (--endpoint) and
+# for the rpc backend giving the same output as transmission-remote, run
+# against the stand-ins in benchmarks/ rather than a real daemon.
+#
+#    python -m unittest discover tests
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fixtures
+import fakeremote
+import stubrpc
+
+ct = fixtures.loadModule()
+
+class StderrCatcher:
+    """Keeps what conkytransmission writes to stderr instead of showing it"""
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+# a localhost port nothing is listening on
+def getDeadPort():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def startServer(torrents):
+    server = stubrpc.StubRPCServer(("localhost", 0), torrents)
+    server.start()
+    return server
+
+def getTotal(torrents, field):
+    return ct.getNumber(ct.getKBps(sum(t[field] for t in torrents)))
+
+class MultiBackendTest(unittest.TestCase):
+    timeout = 0.5
+
+    def setUp(self):
+        self.fast = startServer(fixtures.makeTorrents(5, 1))
+        self.slow = startServer(fixtures.makeTorrents(4, 2))
+        self.dead = "http://localhost:%d/transmission/rpc" % getDeadPort()
+        self.stderr = sys.stderr
+        sys.stderr = StderrCatcher()
+        self.folder = tempfile.mkdtemp()
+        self.config = fixtures.makeConfig(["-b", "rpc", "--endpoint", self.fast.getURL(), "--endpoint", self.slow.getURL(),
+                                           "--endpoint", self.dead, "--endpointtimeout", str(self.timeout), "-c", self.folder])
+        self.backend = ct.getBackend(self.config)
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.folder)
+        for server in (self.fast, self.slow):
+            server.delay = 0
+            server.shutdown()
+            server.server_close()
+
+    def testMerged(self):
+        (torrents, up, down) = self.backend.getTorrents()
+        self.assertEqual(len(torrents), 9)
+        both = self.fast.torrents + self.slow.torrents
+        self.assertEqual(sorted((t.endpoint, t.id) for t in torrents),
+                         sorted([(self.fast.getURL(), t["id"]) for t in self.fast.torrents] +
+                                [(self.slow.getURL(), t["id"]) for t in self.slow.torrents]))
+        self.assertEqual(up, "%.1f" % (getTotal(self.fast.torrents, "rateUpload") + getTotal(self.slow.torrents, "rateUpload")))
+        self.assertEqual(down, "%.1f" % (getTotal(self.fast.torrents, "rateDownload") + getTotal(self.slow.torrents, "rateDownload")))
+        self.assertEqual(sorted(t.name for t in torrents), sorted(t["name"] for t in both))
+        self.assertFalse([t for t in torrents if t.stale])
+        self.assertTrue([l for l in sys.stderr.lines if self.dead in l])
+
+    def testSlowEndpoint(self):
+        self.backend.getTorrents()
+        self.slow.delay = 4 * self.timeout
+        started = time.time()
+        (torrents, up, down) = self.backend.getTorrents()
+        elapsed = time.time() - started
+        self.assertTrue(elapsed < self.timeout + 0.25, "refresh took %.2fs" % elapsed)
+        self.assertEqual(len(torrents), 9)
+        stale = sorted(t.id for t in torrents if t.stale)
+        self.assertEqual(stale, sorted(t["id"] for t in self.slow.torrents))
+        self.assertTrue(all(t.endpoint == self.slow.getURL() for t in torrents if t.stale))
+        self.assertTrue(all(not t.stale for t in torrents if t.endpoint == self.fast.getURL()))
+
+    # without --daemon every refresh is a new run, with a new backend
+    def testSlowEndpointNextRun(self):
+        self.backend.getTorrents()
+        self.slow.delay = 4 * self.timeout
+        (torrents, up, down) = ct.getBackend(self.config).getTorrents()
+        self.assertEqual(len(torrents), 9)
+        stale = [t for t in torrents if t.stale]
+        self.assertEqual(sorted((t.id, t.name, t.endpoint) for t in stale),
+                         sorted((t["id"], t["name"], self.slow.getURL()) for t in self.slow.torrents))
+        self.assertEqual(up, "%.1f" % (getTotal(self.fast.torrents, "rateUpload") + getTotal(self.slow.torrents, "rateUpload")))
+
+    # each endpoint's fetch and parse times are added once its thread is
+    # done, those of one that missed the deadline never
+    def testTimes(self):
+        timer = ct.StageTimer()
+        backend = ct.getBackend(self.config, timer=timer)
+        backend.getTorrents()
+        self.assertEqual((timer.calls["fetch"], timer.calls["parse"]), (2, 2))
+        timer.reset()
+        self.slow.delay = 2 * self.timeout
+        backend.getTorrents()
+        self.assertEqual((timer.calls["fetch"], timer.calls["parse"]), (1, 1))
+        fetched = timer.times["fetch"]
+        time.sleep(2 * self.timeout)
+        self.assertEqual((timer.calls["fetch"], timer.times["fetch"]), (1, fetched))
+        timer.reset()
+        self.slow.delay = 0
+        backend.getTorrents()
+        self.assertEqual((timer.calls["fetch"], timer.calls["parse"]), (2, 2))
+
+class RPCOutputTest(unittest.TestCase):
+    """--backend rpc shows the same as transmission-remote for the same torrents"""
+    count = 40
+    seed = 5
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        fakeremote.writeFixtures(os.path.join(cls.folder, "remote"), cls.count, cls.seed)
+        cls.path = os.environ.get("PATH", "")
+        os.environ["PATH"] = os.path.join(cls.folder, "remote") + os.pathsep + cls.path
+        cls.server = startServer(fixtures.makeTorrents(cls.count, cls.seed))
+        cls.templates = os.path.join(cls.folder, "templates")
+        shutil.copytree(os.path.join(fixtures.MODULE_PATH, "templates"), cls.templates)
+        #one template for every status, showing the -e/--extradata fields
+        cls.extra_templates = os.path.join(cls.folder, "extra")
+        os.mkdir(cls.extra_templates)
+        for name in ("layout.template", "globals.template"):
+            shutil.copy(os.path.join(cls.templates, name), cls.extra_templates)
+        output = open(os.path.join(cls.extra_templates, "torrent_default.template"), "w")
+        try:
+            output.write("[:ID:] [:NAME:] [:STATUS:] [:ETA:] [:RATIO:] [:LOCATION:] [:SIZE:] [:AVAILABLE:] "
+                         "[:UPLOADING_TO:] [:DATETIME_ADDED:] [:PUBLIC_TORRENT:] [:PIECE_SIZE:] [:RATIO_LIMIT:] [:CORRUPT:]\n")
+        finally:
+            output.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ["PATH"] = cls.path
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.folder)
+
+    def render(self, args, templates=None):
+        args = args + ["-t", templates or self.templates, "-c", os.path.join(self.folder, "cache")]
+        remote = ct.ConkyTransmission(fixtures.makeConfig(args)).render()
+        rpc = ct.ConkyTransmission(fixtures.makeConfig(args + ["-b", "rpc", "--rpcurl", self.server.getURL()])).render()
+        return (remote, rpc)
+
+    def testDefault(self):
+        (remote, rpc) = self.render([])
+        self.assertEqual(remote, rpc)
+        self.assertEqual(remote.count("lua_bar"), self.count)
+
+    def testSortBy(self):
+        for sort_by in ("eta", "status,eta,-ratio"):
+            (remote, rpc) = self.render(["-s", sort_by])
+            self.assertEqual(remote, rpc, "differ with -s %s" % sort_by)
+
+    def testExtraData(self):
+        (remote, rpc) = self.render(["-e", "-s", "name"], self.extra_templates)
+        self.assertEqual(remote, rpc)
+        self.assertEqual(remote.count("/home/eric/Downloads"), self.count)
+
+if __name__ == "__main__":
+    unittest.main()
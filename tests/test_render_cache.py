@@ -0,0 +1,170 @@
+# test_render_cache.py
+# Tests for --timeout-ms: rendering in a child process with a deadline,
+# falling back on the last good output kept by RenderCache, run against the
+# fake transmission-remote in benchmarks/ made slow or failing on demand.
+#
+#    python -m unittest discover tests
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fixtures
+import fakeremote
+
+ct = fixtures.loadModule()
+
+# a transmission-remote adding a line to starts.txt each time it is run,
+# then failing if there is a file called fail, or sleeping for as many
+# seconds as the file called delay says, before handing over to the fake
+SCRIPT = """#!/bin/sh
+cd '%(folder)s'
+echo "$*" >> starts.txt
+if [ -e fail ]; then echo "no daemon" >&2; exit 1; fi
+if [ -e delay ]; then sleep "$(cat delay)"; fi
+exec '%(remote)s' "$@"
+"""
+
+class RenderCacheTest(unittest.TestCase):
+    count = 10
+    timeout = 0.5
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        fakeremote.writeFixtures(os.path.join(self.folder, "fake"), self.count, 3)
+        self.bin = os.path.join(self.folder, "bin")
+        os.mkdir(self.bin)
+        script = os.path.join(self.bin, "transmission-remote")
+        self.writeFile(script, SCRIPT % {"folder": self.folder, "remote": os.path.join(self.folder, "fake", "transmission-remote")})
+        os.chmod(script, 0o755)
+        templates = os.path.join(self.folder, "templates")
+        shutil.copytree(os.path.join(fixtures.MODULE_PATH, "templates"), templates)
+        self.writeFile(os.path.join(templates, "globals.template"), "Global: [:G_UP:] stale [:STALE_SECS:]\n")
+        self.args = ["-t", templates, "-c", os.path.join(self.folder, "cache"), "--timeout-ms", str(int(self.timeout * 1000))]
+        self.path = os.environ.get("PATH", "")
+        os.environ["PATH"] = self.bin + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        #let a child that missed its deadline finish before its files go
+        self.setDelay(None)
+        cache = self.getCache()
+        for i in range(100):
+            if not cache.isLocked():
+                break
+            time.sleep(0.1)
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, path, text):
+        output = open(path, "w")
+        try:
+            output.write(text)
+        finally:
+            output.close()
+
+    def setDelay(self, seconds):
+        path = os.path.join(self.folder, "delay")
+        if seconds is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            self.writeFile(path, "%s\n" % seconds)
+
+    def setFailing(self):
+        self.writeFile(os.path.join(self.folder, "fail"), "")
+
+    # how many times transmission-remote was asked for the listing
+    def getStarts(self):
+        path = os.path.join(self.folder, "starts.txt")
+        if not os.path.exists(path):
+            return 0
+        fileinput = open(path)
+        try:
+            return len([l for l in fileinput if l.split() == ["-l"]])
+        finally:
+            fileinput.close()
+
+    def getConky(self):
+        return ct.ConkyTransmission(fixtures.makeConfig(self.args))
+
+    def getCache(self):
+        config = fixtures.makeConfig(self.args)
+        return ct.RenderCache(config.cache_dir, ct.getRenderKey(config.argv))
+
+    # renders with the deadline, returning the output, [:STALE_SECS:] and how long it took
+    def renderWithin(self):
+        started = time.time()
+        output = self.getConky().renderWithin(self.timeout)
+        elapsed = time.time() - started
+        found = re.search(r"stale (\d+)", output)
+        return (output, found and int(found.group(1)), elapsed)
+
+    def testFresh(self):
+        (output, stale, elapsed) = self.renderWithin()
+        self.assertEqual(output.count("lua_bar"), self.count)
+        self.assertEqual(stale, 0)
+        self.assertEqual(self.getCache().output.count("lua_bar"), self.count)
+
+    def testSlowGivesCached(self):
+        (fresh, stale, elapsed) = self.renderWithin()
+        self.setDelay(3)
+        (output, stale, elapsed) = self.renderWithin()
+        self.assertTrue(elapsed < self.timeout + 0.25, "took %.2fs" % elapsed)
+        self.assertEqual(output.replace("stale %d" % stale, "stale 0"), fresh)
+
+    def testStaleSecsGrows(self):
+        self.renderWithin()
+        self.setDelay(5)
+        seen = list()
+        for i in range(3):
+            seen.append(self.renderWithin()[1])
+            time.sleep(1)
+        self.assertTrue(seen[0] < seen[1] < seen[2], "[:STALE_SECS:] went %s" % seen)
+
+    def testOneChildAtATime(self):
+        self.renderWithin()
+        self.setDelay(2)
+        self.renderWithin()
+        self.assertEqual(self.getStarts(), 2)
+        #the child that missed the deadline still holds the lock
+        self.assertTrue(self.getCache().isLocked())
+        (output, stale, elapsed) = self.renderWithin()
+        self.assertEqual(self.getStarts(), 2)
+        self.assertTrue(elapsed < 0.25, "took %.2fs" % elapsed)
+        self.assertEqual(output.count("lua_bar"), self.count)
+
+    def testLockHeld(self):
+        self.renderWithin()
+        cache = self.getCache()
+        self.assertTrue(cache.lock())
+        (output, stale, elapsed) = self.renderWithin()
+        self.assertEqual(self.getStarts(), 1)
+        self.assertEqual(output.count("lua_bar"), self.count)
+        cache.lock_file.close()
+
+    def testBackoffDoubles(self):
+        self.renderWithin()
+        self.setFailing()
+        for failures in range(1, 5):
+            (output, stale, elapsed) = self.renderWithin()
+            self.assertEqual(output.count("lua_bar"), self.count)
+            cache = self.getCache()
+            self.assertEqual(cache.failures, failures)
+            delay = cache.retry_at - time.time()
+            expected = ct.RenderCache.backoff_start * 2 ** (failures - 1)
+            self.assertTrue(expected - 0.5 < delay <= expected, "retry in %.2fs after %d failures" % (delay, failures))
+            #no new child while backing off
+            starts = self.getStarts()
+            self.renderWithin()
+            self.assertEqual(self.getStarts(), starts)
+            cache.retry_at = 0
+            cache.save()
+
+if __name__ == "__main__":
+    unittest.main()
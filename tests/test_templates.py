@@ -0,0 +1,61 @@
+# test_templates.py
+# Tests for TemplateWriter filling in the torrent templates.
+#
+#    python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fixtures
+
+ct = fixtures.loadModule()
+
+class TorrentValueTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = ct.TemplateWriter(fixtures.makeConfig([]))
+        self.torrent = ct.Torrent(fixtures.listing(fixtures.makeTorrents(1, 1))[1])
+
+    def getValue(self, name):
+        return self.writer.getTorrentValue(self.torrent, name)
+
+    def testFields(self):
+        self.assertEqual(self.getValue("id"), str(self.torrent.id))
+        self.assertEqual(self.getValue("status"), self.torrent.status)
+        self.assertEqual(self.getValue("eta_seconds"), str(self.torrent.eta_seconds))
+        self.assertEqual(self.getValue("up_kbps"), self.writer.getSpeed(self.torrent.up))
+
+    def testExtraFields(self):
+        self.assertEqual(self.getValue("location"), None)
+        self.torrent.details = {"location": "/home/eric/Downloads"}
+        self.assertEqual(self.getValue("location"), "/home/eric/Downloads")
+
+    # class attributes and the slots used for working things out stay as [:NAME:]
+    def testInternalsHidden(self):
+        self.torrent.history_slot = 3
+        for name in ("statuses", "detail_setters", "details", "history", "history_slot", "raw_status",
+                     "saved_fields", "extra_fields", "has_extra_data", "getdetail", "__class__"):
+            self.assertEqual(self.getValue(name), None, "[:%s:] shows" % name.upper())
+
+class ResetTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = ct.TemplateWriter(fixtures.makeConfig([]))
+        self.checks = list()
+        check = self.writer.getCriticalTemplates
+        def getCriticalTemplates():
+            self.checks.append(True)
+            return check()
+        self.writer.getCriticalTemplates = getCriticalTemplates
+
+    # __init__ has just checked the templates, so the first render doesn't
+    def testFirstReset(self):
+        self.writer.reset()
+        self.assertEqual(self.checks, [])
+        self.writer.reset()
+        self.writer.reset()
+        self.assertEqual(self.checks, [True, True])
+
+if __name__ == "__main__":
+    unittest.main()